@@ -0,0 +1,51 @@
+"""Compare the Pillow and parallel PNG encoders on seeded synthetic images.
+
+    python benchmarks/png_encoders.py [THREADS]
+
+Prints output size and encode time of both encoders for each image and
+compression level. The images are generated from a fixed seed, so the sizes
+are reproducible on any machine; the times depend on the CPU count.
+"""
+from PIL import Image
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from piccropper.encoders import benchmark_png_encoders  # noqa: E402
+
+WIDTH, HEIGHT = 3000, 2000
+
+def images():
+    import numpy
+    rng = numpy.random.default_rng(1)
+    y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH]
+    gradient = numpy.stack([(x / 12) % 256, (y / 8) % 256, ((x + y) / 20) % 256], axis=-1)
+    tiles = numpy.zeros((HEIGHT, WIDTH, 3), numpy.uint8)
+    tiles[(x // 100 + y // 100) % 2 == 0] = (200, 30, 60)
+
+    def rgb(values):
+        return Image.fromarray(numpy.clip(values, 0, 255).astype(numpy.uint8))
+    return {
+        'flat tiles RGB': Image.fromarray(tiles),
+        'gradient RGB, noise sd 2': rgb(gradient + rng.normal(0, 2, gradient.shape)),
+        'gradient RGB, noise sd 10': rgb(gradient + rng.normal(0, 10, gradient.shape)),
+        'gradient RGB, noise sd 25': rgb(gradient + rng.normal(0, 25, gradient.shape)),
+        'grey RGB, noise sd 3': rgb(128 + rng.normal(0, 3, (HEIGHT, WIDTH, 3))),
+        'uniform noise RGB': Image.fromarray(rng.integers(0, 256, (HEIGHT, WIDTH, 3), numpy.uint8)),
+        'gradient RGBA': rgb(numpy.dstack([gradient, x % 256])),
+    }
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(f"{WIDTH}x{HEIGHT}, {threads or os.cpu_count()} threads")
+    print(f"{'image':28s} {'level':>5s} {'pillow':>12s} {'parallel':>12s} {'size':>7s} {'speed':>6s}")
+    for name, img in images().items():
+        for level in (1, 6, 9):
+            results = benchmark_png_encoders(img, threads, level, repeat=1)
+            pillow, parallel = results['pillow'], results['parallel']
+            print(f"{name:28s} {level:5d} {pillow['bytes']:12,d} {parallel['bytes']:12,d} "
+                  f"{parallel['bytes'] / pillow['bytes']:7.1%} "
+                  f"{pillow['seconds'] / parallel['seconds']:5.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
-from PIL import Image
+from piccropper import (DEFAULT_PIXEL_LIMIT, DEFAULT_RETRIES, ENCODER_PROFILES, PNG_ENCODERS,
+                        LocalStorage, build_manifest, crop_between, crop_stream,
+                        crop_to_array_stack, default_estimate_name, default_manifest_path,
+                        encoder_profile, estimate_run, get_default_cache, is_remote,
+                        list_image_files, load_estimate, load_job_file, merge_manifests,
+                        open_storage, output_name, preflight_scan, print_comparison,
+                        print_estimate, print_preflight_report, quarantine_files, run_jobs,
+                        save_estimate, select_shard, write_manifest)
+import argparse
+import json
 import os
+import time
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import subprocess
@@ -33,8 +43,7 @@ def select_folders():
 
 def find_first_image(input_folder):
     """Find the first image file in the input folder"""
-    image_files = [f for f in os.listdir(input_folder) 
-                   if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+    image_files = list_image_files(input_folder)
     
     if not image_files:
         return None
@@ -141,32 +150,467 @@ if __name__ == "__main__":
         messagebox.showerror("Error", f"Failed to run crop selector: {str(e)}")
         return None
 
-def get_crop_box_from_script():
-    """Extract the crop_box coordinates from this script file"""
+def parse_shard(text):
+    """Parse an 'I/N' shard spec into (index, count), with 0 <= I < N"""
     try:
-        # Read from the pic-bulk-crop.py file specifically
-        script_file = 'pic-bulk-crop.py'
-        with open(script_file, 'r') as f:
-            content = f.read()
-        
-        # Find the crop_box line with actual coordinates (not function calls)
-        for line in content.split('\n'):
-            if (line.strip().startswith('crop_box =') and 
-                '(' in line and 
-                ')' in line and 
-                'get_crop_box_from_script' not in line):
-                # Extract the tuple from the line
-                start = line.find('(')
-                end = line.find(')', start) + 1
-                crop_box_str = line[start:end]
-                return eval(crop_box_str)
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"shard must look like I/N, got {text!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..N-1, got {text!r}")
+    return index, count
+
+def engine_options(args):
+    """Keyword arguments for the crop engine: optional resize and the pixel limit"""
+    return {'size': args.size, 'scale': args.scale, 'max_edge': args.max_edge,
+            'pixel_limit': args.pixel_limit}
+
+def image_options(args):
+    """engine_options() plus the settings that only apply to image outputs"""
+    profile = encoder_profile(args.encoder)
+    return dict(engine_options(args), png_encoder=args.png_encoder or profile['png_encoder'],
+                save_options=profile['save_options'], max_workers=args.workers,
+                timeout=args.timeout, retries=DEFAULT_RETRIES if args.retries is None else args.retries)
+
+def result_entry(result, output):
+    """Manifest entry for one crop result; output is the output file name"""
+    entry = {'file': os.path.basename(result['source']), 'status': result['status'],
+             'seconds': result['seconds']}
+    if result.get('attempts', 1) > 1:
+        entry['attempts'] = result['attempts']
+    if result['status'] == 'ok':
+        entry['output'] = output
+        if result.get('bytes') is not None:
+            entry['bytes'] = result['bytes']
+    else:
+        entry['error'] = result['error']
+    return entry
+
+def print_result(label, entry):
+    """Print one console line for a crop result"""
+    retried = f" (after {entry['attempts']} attempts)" if 'attempts' in entry else ""
+    if entry['status'] == 'ok':
+        print(f"Processed: {label} -> {entry['output']}{retried}")
+    elif entry['status'] == 'timeout':
+        print(f"Timed out: {label}: {entry['error']}")
+    else:
+        print(f"Error processing {label}: {entry['error']}{retried}")
+
+def quarantine_or_warn(input_folder, results, quarantine_folder):
+    """Quarantine failed files; a failure here must not cost the run its manifest"""
+    try:
+        quarantine_files(input_folder, results, quarantine_folder)
+    except OSError as e:
+        print(f"Warning: quarantine failed: {e}")
+
+def print_summary(results):
+    """Print the end-of-run totals and the failed files; returns the number of failures"""
+    counts = {status: sum(1 for r in results if r['status'] == status)
+              for status in ('ok', 'error', 'timeout', 'skipped')}
+    retried = [r for r in results if r.get('attempts', 1) > 1]
+    quarantined = sum(1 for r in results if r.get('quarantined'))
+    
+    print(f"Successfully processed: {counts['ok']} images")
+    if counts['error']:
+        print(f"Errors: {counts['error']} images")
+    if counts['timeout']:
+        print(f"Timed out: {counts['timeout']} images")
+    if retried:
+        recovered = sum(1 for r in retried if r['status'] == 'ok')
+        print(f"Retried after I/O errors: {len(retried)} images ({recovered} recovered)")
+    if quarantined:
+        print(f"Quarantined: {quarantined} images")
+    if counts['skipped']:
+        print(f"Skipped by pre-flight check: {counts['skipped']} images")
+    
+    failed = [r for r in results if r['status'] in ('error', 'timeout')]
+    if failed:
+        print("Failed files:")
+        for r in failed:
+            print(f"  {r['file']} ({r['status']}): {r['error']}")
+    return len(failed)
+
+def crop_images(input_folder, output_folder, image_files, crop_box, image_cache=None, options=None):
+    """Crop each file into the output folder and return one manifest entry per file"""
+    results = []
+    input_paths = [os.path.join(input_folder, fname) for fname in image_files]
+    
+    for result in crop_stream(input_paths, crop_box, output_folder, **(options or {})):
+        entry = result_entry(result, output_name(os.path.basename(result['source'])))
+        if result['status'] == 'ok':
+            entry['bytes'] = os.path.getsize(result['output'])
+        print_result(entry['file'], entry)
+        if result['status'] == 'ok' and image_cache is not None:
+            image_cache.put_metadata(result['source'], result['metadata'])
+        results.append(entry)
+    
+    return results
+
+def crop_stored_images(input_storage, output_storage, image_files, crop_box, options=None):
+    """Crop each object from input storage into output storage and return one
+    manifest entry per file; downloads and uploads overlap the crops"""
+    results = []
+    for result in crop_between(input_storage, output_storage, image_files, crop_box,
+                               **(options or {})):
+        entry = result_entry(result, result['output'])
+        print_result(entry['file'], entry)
+        results.append(entry)
+    return results
+
+def shard_stack_path(stack_path, shard):
+    """Give each shard its own stack file so shards never write to the same one"""
+    if shard is None:
+        return stack_path
+    root, ext = os.path.splitext(stack_path)
+    return f"{root}-shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def crop_images_to_stack(input_folder, image_files, crop_box, stack_path, mode, image_cache=None,
+                         options=None):
+    """Crop each file into one NumPy stack and return one manifest entry per file"""
+    results = []
+    input_paths = [os.path.join(input_folder, fname) for fname in image_files]
+    
+    for result in crop_to_array_stack(input_paths, crop_box, stack_path, mode, **(options or {})):
+        fname = os.path.basename(result['source'])
         
-        return None
+        if result['status'] == 'ok':
+            print(f"Processed: {fname} -> {os.path.basename(stack_path)}[{result['output']}]")
+            if image_cache is not None:
+                image_cache.put_metadata(result['source'], result['metadata'])
+            results.append({'file': fname, 'status': 'ok', 'row': result['output'],
+                            'seconds': result['seconds']})
+        else:
+            print(f"Error processing {fname}: {result['error']}")
+            results.append({'file': fname, 'status': 'error', 'row': result['output'],
+                            'error': result['error'], 'seconds': result['seconds']})
+    
+    return results
+
+def run_merge(args):
+    summary = merge_manifests(args.merge, endpoint_url=args.endpoint_url)
+    
+    print(f"Merged {len(args.merge)} manifests")
+    print(f"Successfully processed: {summary['processed_count']} images")
+    print(f"Errors: {summary['error_count']} images")
+    print(f"Timed out: {summary['timeout_count']} images")
+    print(f"Skipped: {summary['skipped_count']} images")
+    print(f"Retried: {summary['retried_count']} images")
+    print(f"Quarantined: {summary['quarantined_count']} images")
+    for problem in summary['problems']:
+        print(f"Problem: {problem}")
+    
+    if args.merged_manifest:
+        with open(args.merged_manifest, 'w') as f:
+            json.dump(summary, f, indent=1)
+        print(f"Merged manifest written to {args.merged_manifest}")
+    
+    return 1 if summary['problems'] else 0
+
+def job_entry(result):
+    """Manifest entry for one result of a job run"""
+    entry = result_entry(result, result['output'] and os.path.basename(result['output']))
+    if len(result['job']['crop_boxes']) > 1 and result['box'] is not None:
+        entry['box'] = result['box']
+    return entry
+
+def preflight_jobs(jobs, image_cache=None):
+    """Pre-flight every crop box of every job, printing the reports that found
+    problems; returns {job name: [(file, crop box index), ...]} of crops to skip"""
+    skipped = {}
+    for job in jobs:
+        try:
+            image_files = sorted(list_image_files(job['input']))
+        except OSError:
+            continue  # run_jobs() reports the unreadable folder as the job's error
+        for index, box in enumerate(job['crop_boxes']):
+            report = preflight_scan(job['input'], image_files, box, image_cache)
+            bad = report['out_of_bounds'] + [fname for fname, _ in report['unreadable']]
+            if bad:
+                print(f"[{job['name']}] ", end='')
+                print_preflight_report(report, box)
+                skipped.setdefault(job['name'], []).extend((fname, index) for fname in bad)
+    return skipped
+
+def run_job_file(args):
+    """Run every job of a job file through one shared worker pool"""
+    jobs, settings = load_job_file(args.jobs)
+    max_workers = args.workers or settings['max_workers']
+    max_per_job = args.max_per_job or settings['max_per_job']
+    timeout = args.timeout or settings['timeout']
+    retries = next(r for r in (args.retries, settings['retries'], DEFAULT_RETRIES) if r is not None)
+    print(f"{len(jobs)} jobs from {args.jobs}")
+    
+    try:
+        image_cache = get_default_cache()
     except Exception as e:
-        print(f"Error reading crop box: {e}")
-        return None
+        print(f"Warning: image cache unavailable: {e}")
+        image_cache = None
+    
+    skipped = preflight_jobs(jobs, image_cache)
+    skipped_count = sum(len(crops) for crops in skipped.values())
+    if skipped_count and not args.skip_mismatched:
+        print(f"Pre-flight check failed for {skipped_count} crops; "
+              f"use --skip-mismatched to crop the rest anyway.")
+        return 2
+    
+    results = {}
+    skip = set()
+    for job in jobs:
+        results[job['name']] = []
+        for fname, index in skipped.get(job['name'], []):
+            entry = {'file': fname, 'status': 'skipped', 'seconds': 0.0}
+            if len(job['crop_boxes']) > 1:
+                entry['box'] = index
+            results[job['name']].append(entry)
+            skip.add((os.path.join(job['input'], fname), index))
+    finished = set()
+    
+    def finish(job):
+        """Quarantine failed files and write the job's manifest once its last crop is done"""
+        finished.add(job['name'])
+        if args.quarantine:
+            quarantine_or_warn(job['input'], results[job['name']], args.quarantine)
+        boxes = job['crop_boxes']
+        manifest_path = job.get('manifest') or default_manifest_path(job['output'], None)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        write_manifest(manifest_path, job['input'], boxes[0] if len(boxes) == 1 else boxes, None,
+                       results[job['name']])
+        print(f"Manifest written to {manifest_path}")
+    
+    for result in run_jobs(jobs, max_workers=max_workers, max_per_job=max_per_job,
+                           timeout=timeout, retries=retries, skip=skip):
+        job = result['job']
+        entry = job_entry(result)
+        print_result(f"[{job['name']}] {entry['file']}", entry)
+        if result['status'] == 'ok' and image_cache is not None:
+            image_cache.put_metadata(result['source'], result['metadata'])
+        results[job['name']].append(entry)
+        if result['job_done']:
+            finish(job)
+    
+    # Jobs with no images left to crop never produce a result
+    for job in jobs:
+        if job['name'] not in finished:
+            finish(job)
+    
+    print(f"\nProcessing complete!")
+    for job in jobs:
+        job_results = results[job['name']]
+        counts = [sum(1 for r in job_results if r['status'] == status)
+                  for status in ('ok', 'error', 'timeout', 'skipped')]
+        print(f"  {job['name']}: {counts[0]} crops, {counts[1]} errors, {counts[2]} timed out, "
+              f"{counts[3]} skipped")
+    failed_count = print_summary([r for job in jobs for r in results[job['name']]])
+    
+    return 1 if failed_count else 0
+
+def run_headless(args):
+    """Crop a folder without any dialogs, e.g. as one shard on a worker node"""
+    input_folder, output_folder = args.input, args.output
+    crop_box = tuple(args.crop_box)
+    remote = is_remote(input_folder) or is_remote(output_folder)
+    input_storage = output_storage = None
+    if remote:
+        if args.array_stack or args.quarantine:
+            print("--array-stack and --quarantine need local --input and --output folders")
+            return 2
+        input_storage = open_storage(input_folder, endpoint_url=args.endpoint_url)
+        output_storage = open_storage(output_folder, endpoint_url=args.endpoint_url)
+        all_files = input_storage.list_images()
+    else:
+        os.makedirs(output_folder, exist_ok=True)
+        all_files = sorted(list_image_files(input_folder))
+    
+    image_files = select_shard(all_files, args.shard)
+    if args.shard is not None:
+        print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(image_files)} images")
+    
+    try:
+        image_cache = get_default_cache()
+    except Exception as e:
+        print(f"Warning: image cache unavailable: {e}")
+        image_cache = None
+    
+    report = preflight_scan(input_folder, image_files, crop_box, image_cache, storage=input_storage)
+    print_preflight_report(report, crop_box)
+    
+    skipped = report['out_of_bounds'] + [fname for fname, _ in report['unreadable']]
+    if skipped and not args.skip_mismatched and not args.dry_run:
+        print(f"Pre-flight check failed for {len(skipped)} images; "
+              f"use --skip-mismatched to crop the rest anyway.")
+        return 2
+    
+    skipped_set = set(skipped)
+    image_files = [fname for fname in image_files if fname not in skipped_set]
+    
+    if args.estimate:
+        estimate_storage = LocalStorage(os.path.dirname(os.path.abspath(args.estimate)))
+        estimate_name = os.path.basename(args.estimate)
+    else:
+        # Next to the manifest, so a dry run and the real run find the same file
+        estimate_storage = output_storage or LocalStorage(output_folder)
+        estimate_name = default_estimate_name(args.shard)
+    
+    if args.dry_run:
+        if args.array_stack:
+            print("--dry-run estimates image outputs and is not supported with --array-stack")
+            return 2
+        try:
+            estimate = estimate_run(input_folder, image_files, report, crop_box,
+                                    image_options(args), storage=input_storage)
+        except ValueError as e:
+            print(f"Cannot estimate: {e}")
+            return 1
+        print_estimate(estimate)
+        save_estimate(estimate_storage, estimate_name, estimate)
+        print(f"Estimate written to {estimate_storage.url(estimate_name)}")
+        if remote:
+            input_storage.close()
+            output_storage.close()
+        return 0
+    
+    estimate = None if args.array_stack else load_estimate(estimate_storage, estimate_name)
+    started = time.perf_counter()
+    if args.array_stack:
+        if args.timeout:
+            print("--timeout is not supported with --array-stack")
+            return 2
+        stack_path = shard_stack_path(args.array_stack, args.shard)
+        results = crop_images_to_stack(input_folder, image_files, crop_box, stack_path,
+                                       args.array_mode, image_cache, engine_options(args))
+        print(f"Array stack written to {stack_path}")
+    elif remote:
+        results = crop_stored_images(input_storage, output_storage, image_files, crop_box,
+                                     image_options(args))
+    else:
+        results = crop_images(input_folder, output_folder, image_files, crop_box, image_cache,
+                              image_options(args))
+    wall_seconds = time.perf_counter() - started
+    results.extend({'file': fname, 'status': 'skipped', 'seconds': 0.0} for fname in skipped)
+    if args.quarantine:
+        quarantine_or_warn(input_folder, results, args.quarantine)
+    
+    if is_remote(output_folder) and not args.manifest:
+        # Stored next to the crops, like a local manifest
+        manifest_name = os.path.basename(default_manifest_path('', args.shard))
+        manifest = build_manifest(input_folder, crop_box, args.shard, results)
+        output_storage.write(manifest_name, json.dumps(manifest, indent=1).encode('utf-8'))
+        print(f"Manifest written to {output_storage.url(manifest_name)}")
+    else:
+        manifest_path = args.manifest or default_manifest_path(output_folder, args.shard)
+        write_manifest(manifest_path, input_folder, crop_box, args.shard, results)
+        print(f"Manifest written to {manifest_path}")
+    
+    print(f"\nProcessing complete!")
+    failed_count = print_summary(results)
+    
+    if estimate is not None:
+        estimate['actual'] = {
+            'seconds': wall_seconds,
+            'output_bytes': sum(entry.get('bytes', 0) for entry in results),
+            'files': sum(1 for entry in results if entry['status'] == 'ok'),
+        }
+        print_comparison(estimate, estimate['actual'])
+        # Kept with the estimate, to judge how far later estimates can be trusted
+        save_estimate(estimate_storage, estimate_name, estimate)
+    if remote:
+        input_storage.close()
+        output_storage.close()
+    
+    return 1 if failed_count else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Crop all images in a folder to the same box. "
+                    "Without --input/--output/--crop-box the folders and box are chosen interactively.")
+    parser.add_argument('--input', help="folder containing the images to crop, or an "
+                                        "s3://bucket/prefix location (requires boto3)")
+    parser.add_argument('--output', help="folder where cropped images are saved, or an "
+                                         "s3://bucket/prefix location")
+    parser.add_argument('--crop-box', type=int, nargs=4, metavar=('LEFT', 'TOP', 'RIGHT', 'BOTTOM'),
+                        help="crop box in pixels")
+    parser.add_argument('--endpoint-url', metavar='URL',
+                        help="endpoint of an S3-compatible server such as MinIO for s3:// "
+                             "locations (default: AWS, or the AWS_ENDPOINT_URL variable)")
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help="only process shard I of N (0-based); files are assigned by a stable "
+                             "hash of their relative path, so N runs cover the folder exactly once")
+    parser.add_argument('--manifest', help="where to write the result manifest "
+                                           "(default: manifest[-shard-I-of-N].json in the output folder)")
+    parser.add_argument('--skip-mismatched', action='store_true',
+                        help="skip images that fail the pre-flight check instead of aborting")
+    resize = parser.add_mutually_exclusive_group()
+    resize.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help="resize every crop to this size in the same pass as the crop")
+    resize.add_argument('--scale', type=float, help="resize every crop by this factor")
+    resize.add_argument('--max-edge', type=int, metavar='PIXELS',
+                        help="shrink every crop so its longest edge is at most PIXELS")
+    parser.add_argument('--pixel-limit', type=int, default=DEFAULT_PIXEL_LIMIT, metavar='PIXELS',
+                        help="reject inputs with more pixels than this (default: %(default)s); "
+                             "replaces Pillow's decompression-bomb guard, and large uncompressed "
+                             "TIFF/BMP and 8-bit PNG inputs are cropped band by band")
+    parser.add_argument('--png-encoder', choices=PNG_ENCODERS,
+                        help="PNG encoder for PNG outputs: 'parallel' filters and deflates large "
+                             "crops on all CPU cores (requires numpy; default: pillow)")
+    parser.add_argument('--encoder', default='default', choices=sorted(ENCODER_PROFILES),
+                        help="encoder profile: 'fast' and 'small' trade output size against "
+                             "speed, 'parallel' selects the parallel PNG encoder (default: default)")
+    parser.add_argument('--timeout', type=float, metavar='SECONDS',
+                        help="give up on a file after this many seconds; crops then run in worker "
+                             "processes, and a worker stuck on a file is killed and replaced; "
+                             "retries of a file share its time")
+    parser.add_argument('--retries', type=int, metavar='N',
+                        help=f"retry a file up to N times after a transient I/O error "
+                             f"(default: {DEFAULT_RETRIES}); broken images are not retried")
+    parser.add_argument('--quarantine', metavar='FOLDER',
+                        help="move input files that failed or timed out into FOLDER, with the "
+                             "reasons in FOLDER/quarantine.json")
+    parser.add_argument('--array-stack', metavar='PATH',
+                        help="write all crops into one NumPy stack (N x H x W x C, uint8) instead of "
+                             "image files: a memory-mapped .npy or a chunked .npz, plus an index "
+                             "JSON of source names (requires numpy)")
+    parser.add_argument('--array-mode', default='RGB', choices=['L', 'LA', 'RGB', 'RGBA'],
+                        help="pixel mode of the array stack (default: RGB)")
+    parser.add_argument('--jobs', metavar='FILE',
+                        help="run every job of a JSON/TOML job file (folders, crop boxes, format, "
+                             "encoder profile) through one shared worker pool, then exit")
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help="crops in flight at once; with --jobs across all jobs (default: from "
+                             "the job file, else the thread pool default)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="estimate wall time and output size from the file headers and timed "
+                             "trial crops of a sample, without cropping the batch; a later real "
+                             "run compares its actuals against the saved estimate")
+    parser.add_argument('--estimate', metavar='PATH',
+                        help="where --dry-run saves the estimate and a real run looks for it "
+                             "(default: estimate[-shard-I-of-N].json in the output folder)")
+    parser.add_argument('--max-per-job', type=int, metavar='N',
+                        help="with --jobs: crops in flight per job, unless the job sets "
+                             "max_concurrent")
+    parser.add_argument('--merge', nargs='+', metavar='MANIFEST',
+                        help="merge shard manifests (local paths or s3:// URLs) into one summary "
+                             "and check for missing or duplicated files, then exit")
+    parser.add_argument('--merged-manifest', help="where to write the merged summary JSON")
+    return parser.parse_args(argv)
 
 def main():
+    args = parse_args()
+    
+    if args.merge:
+        sys.exit(run_merge(args))
+    
+    if args.jobs:
+        if args.dry_run:
+            print("--dry-run works on --input/--output runs, not on job files")
+            sys.exit(2)
+        sys.exit(run_job_file(args))
+    
+    if args.input or args.output or args.crop_box:
+        if not (args.input and args.output and args.crop_box):
+            print("--input, --output and --crop-box must be given together")
+            sys.exit(2)
+        sys.exit(run_headless(args))
+    
     print("Bulk Picture Cropper")
     print("=" * 50)
     
@@ -207,50 +651,63 @@ def main():
     # Step 4: Process all images
     print("\nStep 4: Processing all images...")
     
-    image_files = [f for f in os.listdir(input_folder) 
-                   if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+    image_files = select_shard(list_image_files(input_folder), args.shard)
     
     if not image_files:
         messagebox.showerror("Error", "No image files found!")
         return
     
-    processed_count = 0
-    error_count = 0
+    # Record image metadata while the headers are parsed anyway, so later
+    # selector sessions and pre-flight checks on this folder can skip it
+    try:
+        image_cache = get_default_cache()
+    except Exception as e:
+        print(f"Warning: image cache unavailable: {e}")
+        image_cache = None
     
-    for fname in image_files:
-        try:
-            input_path = os.path.join(input_folder, fname)
-            
-            # Create output filename with "-cropped" before the file extension
-            name, ext = os.path.splitext(fname)
-            output_fname = f"{name}-cropped{ext}"
-            output_path = os.path.join(output_folder, output_fname)
-            
-            print(f"Processing: {fname} -> {output_fname}")
-            
-            img = Image.open(input_path)
-            cropped = img.crop(crop_box)
-            cropped.save(output_path)
-            
-            processed_count += 1
-            
-        except Exception as e:
-            print(f"Error processing {fname}: {e}")
-            error_count += 1
+    # Check every header before decoding anything, so mismatching or broken
+    # files are caught up front instead of padded with black or failing midway
+    report = preflight_scan(input_folder, image_files, crop_box, image_cache)
+    print_preflight_report(report, crop_box)
+    
+    skipped = report['out_of_bounds'] + [fname for fname, _ in report['unreadable']]
+    if skipped:
+        result = messagebox.askyesno("Pre-flight Check",
+            f"The crop box does not fit {len(report['out_of_bounds'])} images and "
+            f"{len(report['unreadable'])} images are unreadable or truncated.\n\n"
+            f"Skip these {len(skipped)} images and crop the remaining "
+            f"{len(image_files) - len(skipped)}?")
+        if not result:
+            print("Cancelled after pre-flight check.")
+            return
+        skipped_set = set(skipped)
+        image_files = [fname for fname in image_files if fname not in skipped_set]
+    
+    results = crop_images(input_folder, output_folder, image_files, crop_box, image_cache,
+                          image_options(args))
+    processed_count = sum(1 for r in results if r['status'] == 'ok')
+    error_count = sum(1 for r in results if r['status'] == 'error')
+    timeout_count = sum(1 for r in results if r['status'] == 'timeout')
+    results.extend({'file': fname, 'status': 'skipped', 'seconds': 0.0} for fname in skipped)
+    if args.quarantine:
+        quarantine_or_warn(input_folder, results, args.quarantine)
+    
+    if args.manifest or args.shard is not None:
+        manifest_path = args.manifest or default_manifest_path(output_folder, args.shard)
+        write_manifest(manifest_path, input_folder, crop_box, args.shard, results)
+        print(f"Manifest written to {manifest_path}")
     
     # Summary
     print(f"\nProcessing complete!")
-    print(f"Successfully processed: {processed_count} images")
-    if error_count > 0:
-        print(f"Errors: {error_count} images")
+    print_summary(results)
     
     messagebox.showinfo("Complete", 
         f"Bulk cropping complete!\n\n"
         f"Processed: {processed_count} images\n"
         f"Errors: {error_count} images\n"
+        f"Timed out: {timeout_count} images\n"
+        f"Skipped: {len(skipped)} images\n"
         f"Output folder: {output_folder}")
 
-crop_box = (222, 141, 752, 803)  # (left, upper, right, lower)
-
 if __name__ == "__main__":
     main()
@@ -1,10 +1,281 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from PIL import Image, ImageTk
+from piccropper import IMAGE_EXTENSIONS, add_job, get_default_cache
+from piccropper.jobs import DEFAULT_JOB_FILE
+from piccropper.cache import decode_preview
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import os
+import queue
+import threading
+
+def list_images(folder):
+    """Return the sorted paths of all supported images in a folder"""
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries
+                 if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS)]
+    return [os.path.join(folder, name) for name in sorted(names)]
+
+class ThumbnailCache:
+    """Bounded in-memory LRU cache of (thumbnail, original size) pairs keyed by path"""
+    def __init__(self, max_items=500):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+def open_image_cache():
+    """The shared on-disk preview cache, or None if it cannot be used here"""
+    try:
+        return get_default_cache()
+    except Exception as e:
+        print(f"Warning: preview cache unavailable, decoding images directly: {e}")
+        return None
+
+def load_thumbnail(image_path, size, image_cache=None):
+    """Decode a downscaled copy of an image, returning (thumbnail, original size)"""
+    if image_cache is not None:
+        thumb, metadata = image_cache.get_preview(image_path, size)
+        return thumb, (metadata['width'], metadata['height'])
+    
+    with Image.open(image_path) as img:
+        original_size = img.size
+        thumb = decode_preview(img, size)
+    return thumb, original_size
+
+class Filmstrip:
+    """Scrollable strip of folder thumbnails with the current crop box overlaid.
+
+    Only the cells in (or near) the visible range are drawn. Thumbnails are
+    decoded by a background thread pool and handed back to the Tk thread
+    through a queue, so folders with tens of thousands of files stay smooth.
+    """
+    THUMB_SIZE = 96
+    PADDING = 6
+    LABEL_HEIGHT = 14
+    PREFETCH = 8  # Extra cells loaded on each side of the visible range
+
+    def __init__(self, parent, image_paths, on_select=None, max_cached=500, workers=4, image_cache=None):
+        self.image_paths = image_paths
+        self.on_select = on_select
+        self.image_cache = image_cache
+        self.crop_box = None
+        self.current_index = None
+        self.cell_width = self.THUMB_SIZE + 2 * self.PADDING
+
+        self.cache = ThumbnailCache(max_cached)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self.pending = {}  # index -> future
+        self.results = queue.Queue()
+        self.photos = {}  # index -> PhotoImage, only for drawn cells
+        self.drawn = set()
+        self.refresh_scheduled = False
+        self.closed = False
+
+        self.frame = ttk.LabelFrame(parent, text=f"Folder ({len(image_paths)} images)")
+
+        height = self.THUMB_SIZE + 2 * self.PADDING + self.LABEL_HEIGHT
+        self.canvas = tk.Canvas(self.frame, height=height, bg='gray80', highlightthickness=0,
+                                scrollregion=(0, 0, len(image_paths) * self.cell_width, height))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.canvas.configure(xscrollcommand=self.on_xscroll)
+
+        self.canvas.pack(fill=tk.X, expand=True)
+        self.scrollbar.pack(fill=tk.X)
+
+        self.canvas.bind("<Configure>", lambda e: self.schedule_refresh())
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.xview_scroll(-3, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.xview_scroll(3, "units"))
+        self.canvas.configure(xscrollincrement=self.cell_width)
+
+        self.poll_results()
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def close(self):
+        """Stop the background workers and drop any queued thumbnail jobs"""
+        self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def on_xscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def on_mouse_wheel(self, event):
+        self.canvas.xview_scroll(-1 if event.delta > 0 else 1, "units")
+
+    def on_click(self, event):
+        index = int(self.canvas.canvasx(event.x) // self.cell_width)
+        if 0 <= index < len(self.image_paths) and self.on_select:
+            self.on_select(self.image_paths[index])
+
+    def set_current(self, image_path):
+        """Highlight the image currently shown in the main view"""
+        previous = self.current_index
+        try:
+            self.current_index = self.image_paths.index(image_path)
+        except ValueError:
+            self.current_index = None
+        for index in (previous, self.current_index):
+            if index in self.drawn:
+                self.draw_cell(index)
+
+    def set_crop_box(self, crop_box):
+        """Redraw the crop overlay on every visible thumbnail"""
+        self.crop_box = crop_box
+        for index in list(self.drawn):
+            self.draw_overlay(index)
+
+    def schedule_refresh(self):
+        if not self.refresh_scheduled and not self.closed:
+            self.refresh_scheduled = True
+            self.canvas.after_idle(self.refresh)
+
+    def visible_range(self):
+        left = self.canvas.canvasx(0)
+        right = self.canvas.canvasx(self.canvas.winfo_width())
+        first = max(0, int(left // self.cell_width))
+        last = min(len(self.image_paths), int(right // self.cell_width) + 1)
+        return first, last
+
+    def refresh(self):
+        """Draw newly visible cells, forget hidden ones and queue missing thumbnails"""
+        self.refresh_scheduled = False
+        if self.closed:
+            return
+
+        first, last = self.visible_range()
+        visible = set(range(first, last))
+        wanted = set(range(max(0, first - self.PREFETCH),
+                           min(len(self.image_paths), last + self.PREFETCH)))
+
+        for index in self.drawn - visible:
+            self.canvas.delete(f"cell{index}")
+            self.photos.pop(index, None)
+        self.drawn &= visible
+
+        # Cancel loads that scrolled far out of view so the pool only works on what is needed
+        for index in list(self.pending):
+            if index not in wanted and self.pending[index].cancel():
+                del self.pending[index]
+
+        for index in visible - self.drawn:
+            self.draw_cell(index)
+
+        for index in sorted(wanted, key=lambda i: (i not in visible, i)):
+            path = self.image_paths[index]
+            if index in self.pending or self.cache.get(path) is not None:
+                continue
+            future = self.executor.submit(load_thumbnail, path, self.THUMB_SIZE, self.image_cache)
+            future.add_done_callback(lambda f, i=index: self.results.put((i, f)))
+            self.pending[index] = future
+
+    def poll_results(self):
+        """Move finished thumbnails from the worker pool onto the canvas (Tk thread only)"""
+        if self.closed:
+            return
+
+        while True:
+            try:
+                index, future = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            # Ignore cancelled jobs and results superseded by a newer request
+            if self.pending.get(index) is not future or future.cancelled():
+                continue
+            del self.pending[index]
+
+            path = self.image_paths[index]
+            try:
+                self.cache.put(path, future.result())
+            except Exception as e:
+                self.cache.put(path, (None, None))
+                print(f"Error creating thumbnail for {path}: {e}")
+
+            if index in self.drawn:
+                self.draw_cell(index)
+
+        self.canvas.after(50, self.poll_results)
+
+    def cell_origin(self, index):
+        return index * self.cell_width + self.PADDING, self.PADDING
+
+    def draw_cell(self, index):
+        tag = f"cell{index}"
+        self.canvas.delete(tag)
+        self.drawn.add(index)
+
+        x0, y0 = self.cell_origin(index)
+        path = self.image_paths[index]
+        outline = "blue" if index == self.current_index else "gray60"
+        self.canvas.create_rectangle(x0 - 2, y0 - 2, x0 + self.THUMB_SIZE + 2, y0 + self.THUMB_SIZE + 2,
+                                     outline=outline, width=2, tags=(tag,))
+
+        name = os.path.basename(path)
+        if len(name) > 16:
+            name = name[:7] + "…" + name[-8:]
+        self.canvas.create_text(x0 + self.THUMB_SIZE // 2, y0 + self.THUMB_SIZE + self.LABEL_HEIGHT // 2 + 2,
+                                text=name, font=("TkDefaultFont", 7), tags=(tag,))
+
+        cached = self.cache.get(path)
+        if cached is None:
+            self.photos.pop(index, None)
+        elif cached[0] is None:
+            self.canvas.create_text(x0 + self.THUMB_SIZE // 2, y0 + self.THUMB_SIZE // 2,
+                                    text="unreadable", fill="red", tags=(tag,))
+        else:
+            thumb = cached[0]
+            self.photos[index] = ImageTk.PhotoImage(thumb)
+            self.canvas.create_image(x0 + (self.THUMB_SIZE - thumb.width) // 2,
+                                     y0 + (self.THUMB_SIZE - thumb.height) // 2,
+                                     anchor=tk.NW, image=self.photos[index], tags=(tag,))
+
+        self.draw_overlay(index)
+
+    def draw_overlay(self, index):
+        """Draw the crop box on one thumbnail, flagging images the box does not fit"""
+        tag = f"overlay{index}"
+        self.canvas.delete(tag)
+
+        cached = self.cache.get(self.image_paths[index])
+        if self.crop_box is None or cached is None or cached[0] is None:
+            return
+
+        thumb, (width, height) = cached
+        left, top, right, bottom = self.crop_box
+        scale = thumb.width / width
+        x0, y0 = self.cell_origin(index)
+        x0 += (self.THUMB_SIZE - thumb.width) // 2
+        y0 += (self.THUMB_SIZE - thumb.height) // 2
+
+        fits = right <= width and bottom <= height
+        self.canvas.create_rectangle(x0 + left * scale, y0 + top * scale,
+                                     x0 + min(right, width) * scale, y0 + min(bottom, height) * scale,
+                                     outline="red" if fits else "orange", width=1,
+                                     dash=() if fits else (3, 2), tags=(tag, f"cell{index}"))
 
 class CropSelector:
-    def __init__(self, image_path):
+    FIT_PREVIEW_EDGE = 1600  # Longest edge of the cached preview used for zoomed-out views
+    
+    def __init__(self, image_path, image_paths=None):
         self.root = tk.Tk()
         self.root.title("Crop Box Selector")
         
@@ -25,8 +296,16 @@ class CropSelector:
         
         self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
         
-        # Load original image
+        # Load original image (pixels are only decoded once a view needs them)
+        self.image_path = image_path
         self.original_image = Image.open(image_path)
+        self.image_cache = open_image_cache()
+        self.fit_preview = None
+        
+        # All images in the folder, shown in the filmstrip
+        if image_paths is None:
+            image_paths = list_images(os.path.dirname(image_path) or '.')
+        self.image_paths = image_paths
         
         # Zoom and display variables
         self.zoom_level = 1.0
@@ -107,6 +386,12 @@ class CropSelector:
         # Bind canvas resize event
         self.canvas.bind("<Configure>", self.on_canvas_resize)
         
+        # Filmstrip of every image in the folder, to check the crop box fits them all
+        self.filmstrip = Filmstrip(main_frame, self.image_paths, on_select=self.load_image,
+                                   image_cache=self.image_cache)
+        self.filmstrip.pack(fill=tk.X, pady=(10, 0))
+        self.filmstrip.set_current(image_path)
+        
         # Mouse selection variables
         self.start_x = None
         self.start_y = None
@@ -206,10 +491,8 @@ class CropSelector:
         inst_frame = ttk.Frame(main_frame)
         inst_frame.pack(fill=tk.X, pady=(10, 0))
         
-        instructions = ttk.Label(inst_frame, 
-            text=f"Instructions: Left-click+drag: Draw rectangle • Right-click+drag: Pan • Arrow keys: Fine-tune corner • Resize window for larger view\nImage size: {self.original_image.width}x{self.original_image.height} pixels",
-            justify=tk.LEFT)
-        instructions.pack(side=tk.LEFT)
+        self.instructions = ttk.Label(inst_frame, text=self.instructions_text(), justify=tk.LEFT)
+        self.instructions.pack(side=tk.LEFT)
         
         self.crop_box = None
         self.current_selection_canvas = None
@@ -222,13 +505,50 @@ class CropSelector:
         # Initialize display image after all UI elements are created
         self.update_display_image()
         
+    def instructions_text(self):
+        return (f"Instructions: Left-click+drag: Draw rectangle • Right-click+drag: Pan • Arrow keys: Fine-tune corner • Click filmstrip: Preview another image\n"
+                f"Image: {os.path.basename(self.image_path)} - {self.original_image.width}x{self.original_image.height} pixels")
+    
+    def load_image(self, image_path):
+        """Show another image from the folder, keeping the current crop box"""
+        if image_path == self.image_path:
+            return
+        
+        try:
+            image = Image.open(image_path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to open {image_path}: {str(e)}")
+            return
+        
+        self.original_image.close()
+        self.original_image = image
+        self.image_path = image_path
+        self.fit_preview = None
+        self.base_scale = min(
+            self.max_canvas_width / self.original_image.width,
+            self.max_canvas_height / self.original_image.height,
+            1.0
+        )
+        
+        self.rect_id = None
+        self.corner_indicators.clear()
+        self.update_display_image()
+        self.redraw_selection()
+        self.instructions.config(text=self.instructions_text())
+        self.filmstrip.set_current(image_path)
+        
+        if self.crop_box:
+            left, top, right, bottom = self.crop_box
+            if right > self.original_image.width or bottom > self.original_image.height:
+                self.info_label.config(text=f"Crop box {self.crop_box} exceeds this image ({self.original_image.width}x{self.original_image.height})")
+    
     def update_display_image(self):
         """Update the display image based on current zoom and pan"""
         effective_scale = self.base_scale * self.zoom_level
         new_width = int(self.original_image.width * effective_scale)
         new_height = int(self.original_image.height * effective_scale)
         
-        self.display_image = self.original_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        self.display_image = self.display_source(new_width, new_height).resize((new_width, new_height), Image.Resampling.LANCZOS)
         self.photo = ImageTk.PhotoImage(self.display_image)
         
         # Update canvas (only if canvas exists)
@@ -241,6 +561,22 @@ class CropSelector:
         if hasattr(self, 'zoom_label'):
             self.zoom_label.config(text=f"Zoom: {self.zoom_level:.1f}x")
         
+    def display_source(self, width, height):
+        """Image to resize for display: the cached preview when it is large enough"""
+        if self.image_cache is None or max(width, height) > self.FIT_PREVIEW_EDGE:
+            return self.original_image
+        
+        if self.fit_preview is None:
+            try:
+                self.fit_preview, _ = self.image_cache.get_preview(self.image_path, self.FIT_PREVIEW_EDGE)
+            except Exception as e:
+                print(f"Warning: could not load cached preview: {e}")
+                return self.original_image
+        
+        if self.fit_preview.width < width or self.fit_preview.height < height:
+            return self.original_image
+        return self.fit_preview
+    
     def canvas_to_image_coords(self, canvas_x, canvas_y):
         """Convert canvas coordinates to original image coordinates"""
         # Convert canvas coordinates to scrolled canvas coordinates
@@ -490,6 +826,7 @@ class CropSelector:
         
         self.info_label.config(text="Draw a rectangle or enter coordinates manually")
         self.crop_box = None
+        self.filmstrip.set_crop_box(None)
     
     def confirm_selection(self):
         if self.crop_box is None:
@@ -497,29 +834,24 @@ class CropSelector:
             return
         
         result = messagebox.askyesno("Confirm", 
-            f"Use crop box {self.crop_box}?\n\nThis will update your pic-bulk-crop.py file.")
+            f"Use crop box {self.crop_box}?\n\nThis will add a job to {DEFAULT_JOB_FILE}.")
         
         if result:
-            self.update_crop_script()
+            self.save_crop_job()
             messagebox.showinfo("Success", 
-                f"Updated pic-bulk-crop.py with crop_box = {self.crop_box}")
+                f"Saved crop box {self.crop_box} to {DEFAULT_JOB_FILE}.\n\n"
+                f"Run all saved jobs with:\npython bulk-pic-cropper.py --jobs {DEFAULT_JOB_FILE}")
             self.root.quit()
     
-    def update_crop_script(self):
-        # Read the current script
-        with open('pic-bulk-crop.py', 'r') as f:
-            content = f.read()
-        
-        # Replace the crop_box line
-        lines = content.split('\n')
-        for i, line in enumerate(lines):
-            if 'crop_box =' in line:
-                lines[i] = f"crop_box = {self.crop_box}  # (left, upper, right, lower)"
-                break
-        
-        # Write back
-        with open('pic-bulk-crop.py', 'w') as f:
-            f.write('\n'.join(lines))
+    def save_crop_job(self):
+        """Add (or replace) the job for this image's folder in the job file.
+        
+        Crops go to a "<folder>-cropped" folder next to the input, so jobs
+        saved for different folders never write into the same place.
+        """
+        input_folder = os.path.relpath(os.path.dirname(os.path.abspath(self.image_path)))
+        add_job(DEFAULT_JOB_FILE, {'input': input_folder, 'output': f"{input_folder}-cropped",
+                                   'crop_box': list(self.crop_box)})
     
     def on_key_press(self, event):
         """Handle arrow key presses for fine-tuning corners"""
@@ -612,6 +944,9 @@ class CropSelector:
         # Update info label
         corner = self.selected_corner.get()
         self.info_label.config(text=f"Selection: ({left}, {top}, {right}, {bottom}) - Size: {width}x{height} pixels - Corner: {corner}")
+        
+        # Update the overlay on the folder thumbnails
+        self.filmstrip.set_crop_box(self.crop_box)
     
     def highlight_selected_corner(self):
         """Add visual indicator for the selected corner"""
@@ -705,23 +1040,25 @@ class CropSelector:
                 self.fit_to_window()
     
     def run(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.filmstrip.close()
 
 def main():
     input_folder = 'pic-input'
     
     # Find the first image
-    image_files = [f for f in os.listdir(input_folder) 
-                   if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
+    image_paths = list_images(input_folder)
     
-    if not image_files:
+    if not image_paths:
         print("No image files found in pic-input folder!")
         return
     
-    first_image = os.path.join(input_folder, sorted(image_files)[0])
+    first_image = image_paths[0]
     print(f"Opening first image: {first_image}")
     
-    selector = CropSelector(first_image)
+    selector = CropSelector(first_image, image_paths)
     selector.run()
 
 if __name__ == "__main__":
@@ -0,0 +1,26 @@
+"""Importable crop engine behind bulk-pic-cropper.py and pic-crop-selector.py.
+
+Example::
+
+    from piccropper import crop_stream
+
+    for result in crop_stream(paths, (222, 141, 752, 803), output_folder='out'):
+        print(result['source'], result['status'], result['seconds'])
+"""
+from .arrays import crop_to_array_stack
+from .cache import ImageCache, get_default_cache
+from .encoders import (ENCODER_PROFILES, PNG_ENCODERS, benchmark_png_encoders, encoder_profile,
+                       save_image, save_parallel_png)
+from .engine import (IMAGE_EXTENSIONS, crop_one, crop_stream, fused_crop, list_image_files,
+                     output_name, read_metadata, target_size)
+from .estimate import (default_estimate_name, estimate_run, load_estimate, print_comparison,
+                       print_estimate, save_estimate, stratified_sample)
+from .guard import (DEFAULT_RETRIES, CropTimeoutError, TimeoutPool, WorkerCrashedError,
+                    is_transient, quarantine_files)
+from .jobs import add_job, load_job_file, run_jobs
+from .mapped import mapped_crop
+from .preflight import check_truncated, preflight_scan, print_preflight_report
+from .storage import LocalStorage, S3Storage, crop_between, is_remote, open_storage
+from .tiled import DEFAULT_PIXEL_LIMIT, open_image, tiled_crop
+from .sharding import (build_manifest, default_manifest_path, merge_manifests, select_shard,
+                       shard_of, write_manifest)
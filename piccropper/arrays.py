@@ -0,0 +1,165 @@
+"""Export same-size crops straight into a NumPy array stack.
+
+Every crop made with one crop box has the same dimensions, so instead of
+writing one image file per input the crops can go into a single N x H x W x C
+uint8 array: a preallocated memory-mapped .npy file that workers fill in
+place, or a .npz archive written one chunk at a time. An index JSON next to
+the stack lists the source file of every row.
+
+NumPy is optional and only imported when an array export is requested.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .engine import default_max_pending, fused_crop, read_metadata, run_bounded, target_size
+from .tiled import DEFAULT_PIXEL_LIMIT, open_image
+import json
+import os
+import time
+import zipfile
+
+MODE_CHANNELS = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for array export: pip install numpy") from None
+    return numpy
+
+def index_path(stack_path):
+    """Path of the JSON index written next to an array stack"""
+    return os.path.splitext(stack_path)[0] + '-index.json'
+
+def stack_shape(count, crop_box, mode, output_size=None):
+    left, top, right, bottom = crop_box
+    width, height = output_size or (right - left, bottom - top)
+    return count, height, width, MODE_CHANNELS[mode]
+
+def crop_to_array(input_path, crop_box, mode, output_size=None, pixel_limit=DEFAULT_PIXEL_LIMIT):
+    """Decode one image and return (metadata, H x W x C uint8 array of the crop)"""
+    numpy = _import_numpy()
+    with open_image(input_path, pixel_limit) as img:
+        metadata = read_metadata(img)
+        cropped = fused_crop(img, crop_box, output_size)
+        if cropped.mode != mode:
+            cropped = cropped.convert(mode)
+        array = numpy.asarray(cropped)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return metadata, array
+
+def _crop_into_npy(input_path, index, stack_path, crop_box, mode, output_size, pixel_limit):
+    """Write one crop into row `index` of the memory-mapped stack on disk.
+
+    The stack is re-opened by path, so this also works in a worker process.
+    """
+    numpy = _import_numpy()
+    started = time.perf_counter()
+    metadata, array = crop_to_array(input_path, crop_box, mode, output_size, pixel_limit)
+    stack = numpy.load(stack_path, mmap_mode='r+')
+    stack[index] = array
+    stack.flush()
+    del stack
+    return metadata, time.perf_counter() - started
+
+def _crop_into_buffer(input_path, index, buffer, crop_box, mode, output_size, pixel_limit):
+    """Write one crop into row `index` of an in-memory chunk (threads only)"""
+    started = time.perf_counter()
+    metadata, array = crop_to_array(input_path, crop_box, mode, output_size, pixel_limit)
+    buffer[index] = array
+    return metadata, time.perf_counter() - started
+
+def _result(input_path, future):
+    try:
+        metadata, seconds = future.result()
+    except Exception as e:
+        return {'source': input_path, 'status': 'error', 'output': None, 'data': None,
+                'metadata': None, 'seconds': 0.0, 'attempts': 1, 'error': str(e)}
+    return {'source': input_path, 'status': 'ok', 'output': None, 'data': None,
+            'metadata': metadata, 'seconds': seconds, 'attempts': 1, 'error': None}
+
+def write_index(stack_path, input_paths, crop_box, mode, shape, failed, chunk_size=None):
+    index = {
+        'stack': os.path.basename(stack_path),
+        'shape': list(shape),
+        'dtype': 'uint8',
+        'mode': mode,
+        'crop_box': list(crop_box),
+        'chunk_size': chunk_size,
+        'files': [os.path.basename(path) for path in input_paths],
+        # Rows of files that failed are left zero-filled
+        'failed_rows': sorted(failed),
+    }
+    with open(index_path(stack_path), 'w') as f:
+        json.dump(index, f, indent=1)
+
+def crop_to_array_stack(input_paths, crop_box, stack_path, mode='RGB', executor=None,
+                        max_workers=None, max_pending=None, chunk_size=256,
+                        size=None, scale=None, max_edge=None, pixel_limit=DEFAULT_PIXEL_LIMIT):
+    """Crop every input into one array stack and yield a result dict per file.
+
+    stack_path ending in .npy preallocates a memory-mapped stack that workers
+    (threads or processes) fill in place. Ending in .npz writes chunks of
+    chunk_size crops as separate 'chunk_00000' arrays, which needs a thread
+    pool since workers share the in-memory chunk. size, scale, max_edge and
+    pixel_limit work as in crop_stream(). Results follow
+    crop_stream() except that 'output' holds the row index in the stack.
+    """
+    numpy = _import_numpy()
+    input_paths = list(input_paths)
+    crop_box = tuple(crop_box)
+    if mode not in MODE_CHANNELS:
+        raise ValueError(f"unsupported array mode {mode!r}; use one of {sorted(MODE_CHANNELS)}")
+    output_size = target_size(crop_box, size, scale, max_edge)
+    shape = stack_shape(len(input_paths), crop_box, mode, output_size)
+    if stack_path.endswith('.npz') and isinstance(executor, ProcessPoolExecutor):
+        raise ValueError(".npz export fills chunks in shared memory and needs a thread pool")
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    if max_pending is None:
+        max_pending = default_max_pending(executor, max_workers)
+
+    failed = set()
+    try:
+        if stack_path.endswith('.npz'):
+            results = _fill_npz(numpy, input_paths, crop_box, stack_path, mode, shape,
+                                executor, max_pending, chunk_size, output_size, pixel_limit)
+        else:
+            # Preallocate the whole stack on disk; nothing is held in memory
+            stack = numpy.lib.format.open_memmap(stack_path, mode='w+', dtype=numpy.uint8, shape=shape)
+            del stack
+            jobs = ((index, _crop_into_npy, (path, index, stack_path, crop_box, mode,
+                                             output_size, pixel_limit))
+                    for index, path in enumerate(input_paths))
+            results = ((index, _result(input_paths[index], future))
+                       for index, future in run_bounded(executor, jobs, max_pending))
+
+        for index, result in results:
+            result['output'] = index
+            if result['status'] != 'ok':
+                failed.add(index)
+            yield result
+
+        write_index(stack_path, input_paths, crop_box, mode, shape, failed,
+                    chunk_size if stack_path.endswith('.npz') else None)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def _fill_npz(numpy, input_paths, crop_box, stack_path, mode, shape,
+              executor, max_pending, chunk_size, output_size, pixel_limit):
+    """Fill one chunk at a time in memory and append it to the .npz archive"""
+    with zipfile.ZipFile(stack_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for chunk_number, start in enumerate(range(0, len(input_paths), chunk_size)):
+            chunk_paths = input_paths[start:start + chunk_size]
+            buffer = numpy.zeros((len(chunk_paths),) + shape[1:], dtype=numpy.uint8)
+
+            jobs = ((offset, _crop_into_buffer, (path, offset, buffer, crop_box, mode,
+                                                 output_size, pixel_limit))
+                    for offset, path in enumerate(chunk_paths))
+            for offset, future in run_bounded(executor, jobs, max_pending):
+                yield start + offset, _result(chunk_paths[offset], future)
+
+            with archive.open(f"chunk_{chunk_number:05d}.npy", 'w', force_zip64=True) as f:
+                numpy.lib.format.write_array(f, buffer, allow_pickle=False)
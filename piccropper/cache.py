@@ -0,0 +1,205 @@
+"""Persistent on-disk cache of image previews and metadata.
+
+Entries are keyed by absolute path, file size and mtime, so an image that is
+edited or replaced is never served stale. Metadata and the LRU bookkeeping
+live in a small SQLite index (safe to share between threads and processes),
+previews are stored next to it as PNG files and evicted least recently used
+first once the cache grows beyond its size limit.
+"""
+from PIL import Image
+from .engine import read_metadata
+from .tiled import IN_MEMORY_PIXEL_LIMIT, open_image
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'BULK_PIC_CROPPER_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'bulk-pic-cropper'))
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    format TEXT
+);
+CREATE INDEX IF NOT EXISTS metadata_path ON metadata (path);
+CREATE TABLE IF NOT EXISTS previews (
+    key TEXT NOT NULL,
+    max_edge INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (key, max_edge)
+);
+CREATE INDEX IF NOT EXISTS previews_last_access ON previews (last_access);
+"""
+
+def decode_preview(img, max_edge):
+    """Downscale an opened image so its longest edge is at most max_edge"""
+    # Let JPEG decode at reduced resolution instead of full size
+    img.draft('RGB', (max_edge, max_edge))
+    img.thumbnail((max_edge, max_edge), Image.Resampling.BILINEAR)
+    return img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+class ImageCache:
+    """Previews and header metadata for image files, persisted across runs"""
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, 'previews'), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        """One SQLite connection per thread; WAL lets readers and a writer overlap"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite3'), timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(path):
+        """Cache key for the current state of a file on disk"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        raw = f"{path}\0{st.st_size}\0{st.st_mtime_ns}".encode('utf-8', 'surrogateescape')
+        return hashlib.sha1(raw).hexdigest(), path
+
+    def _store_metadata(self, key, path, metadata):
+        conn = self._connect()
+        with conn:
+            # Drop rows left behind by earlier versions of the same file
+            conn.execute('DELETE FROM metadata WHERE path = ? AND key != ?', (path, key))
+            conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)',
+                         (key, path, metadata['width'], metadata['height'],
+                          metadata['mode'], metadata['format']))
+
+    def _lookup_metadata(self, key):
+        row = self._connect().execute(
+            'SELECT width, height, mode, format FROM metadata WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('width', 'height', 'mode', 'format'), row))
+
+    def get_metadata(self, path):
+        """Dimensions, mode and format of an image, read from its header on a miss"""
+        key, path = self.make_key(path)
+        metadata = self._lookup_metadata(key)
+        if metadata is None:
+            # Only the header is read, so no pixel limit is needed
+            with open_image(path, pixel_limit=None) as img:
+                metadata = read_metadata(img)
+            self._store_metadata(key, path, metadata)
+        return metadata
+
+    def put_metadata(self, path, metadata):
+        """Record metadata (see read_metadata) the caller already has at hand.
+
+        A failure only costs the cache entry, so it is reported as a warning.
+        """
+        try:
+            key, path = self.make_key(path)
+            self._store_metadata(key, path, metadata)
+        except (OSError, sqlite3.Error) as e:
+            warnings.warn(f"could not cache metadata for {path}: {e}", RuntimeWarning, stacklevel=2)
+
+    def get_preview(self, path, max_edge):
+        """Return (preview, metadata) with the preview's longest edge at most max_edge"""
+        key, path = self.make_key(path)
+        conn = self._connect()
+        row = conn.execute('SELECT filename FROM previews WHERE key = ? AND max_edge = ?',
+                           (key, max_edge)).fetchone()
+        metadata = self._lookup_metadata(key)
+
+        if row is not None and metadata is not None:
+            try:
+                with Image.open(os.path.join(self.cache_dir, 'previews', row[0])) as cached:
+                    preview = cached.copy()
+                with conn:
+                    conn.execute('UPDATE previews SET last_access = ? WHERE key = ? AND max_edge = ?',
+                                 (time.time(), key, max_edge))
+                return preview, metadata
+            except (OSError, sqlite3.Error):
+                pass  # Evicted or damaged by another process; rebuild below
+
+        # thumbnail() decodes the whole image (JPEGs excepted), so keep to
+        # what can be decoded in memory
+        with open_image(path, IN_MEMORY_PIXEL_LIMIT) as img:
+            metadata = read_metadata(img)
+            preview = decode_preview(img, max_edge)
+        self._store_metadata(key, path, metadata)
+        self._store_preview(key, max_edge, preview)
+        return preview, metadata
+
+    def _store_preview(self, key, max_edge, preview):
+        filename = f"{key}-{max_edge}.png"
+        preview_dir = os.path.join(self.cache_dir, 'previews')
+        # Write to a temporary name first so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=preview_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                preview.save(f, format='PNG', compress_level=1)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, os.path.join(preview_dir, filename))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO previews VALUES (?, ?, ?, ?, ?)',
+                         (key, max_edge, filename, size, time.time()))
+        self.evict()
+
+    def total_bytes(self):
+        return self._connect().execute('SELECT COALESCE(SUM(bytes), 0) FROM previews').fetchone()[0]
+
+    def evict(self):
+        """Delete least recently used previews until the cache fits in max_bytes"""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Another thread is already evicting
+        try:
+            conn = self._connect()
+            excess = self.total_bytes() - self.max_bytes
+            if excess <= 0:
+                return
+
+            rows = conn.execute(
+                'SELECT key, max_edge, filename, bytes FROM previews ORDER BY last_access').fetchall()
+            for key, max_edge, filename, size in rows:
+                if excess <= 0:
+                    break
+                with conn:
+                    conn.execute('DELETE FROM previews WHERE key = ? AND max_edge = ?', (key, max_edge))
+                try:
+                    os.remove(os.path.join(self.cache_dir, 'previews', filename))
+                except FileNotFoundError:
+                    pass  # Already removed by another process
+                excess -= size
+        finally:
+            self._evict_lock.release()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """Process-wide cache in DEFAULT_CACHE_DIR, created on first use"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ImageCache()
+        return _default_cache
@@ -0,0 +1,242 @@
+"""Output encoders, including a multi-threaded PNG writer.
+
+Pillow deflates a PNG on one thread, which dominates the time spent on large
+crops and cannot be spread over worker processes when a single big image is
+the long tail of a batch. The parallel writer splits the rows into chunks and
+works on them on a thread pool, pigz-style:
+
+- each chunk is filtered row by row with the adaptive heuristic from the PNG
+  specification (the filter type with the smallest sum of absolute
+  differences wins; palette images use no filter), vectorised with NumPy;
+- each chunk is compressed as a raw deflate stream primed with the last 32 KB
+  of the chunk before it, and ended with a sync flush so the streams can be
+  concatenated into one zlib stream.
+
+zlib and NumPy release the GIL, so the chunks really run in parallel. The
+result is an ordinary PNG that any decoder reads. NumPy is only imported when
+the parallel encoder is used.
+"""
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import struct
+import sys
+import time
+import zlib
+
+PNG_ENCODERS = ('pillow', 'parallel')
+# Named sets of encoder settings, selectable per job: the PNG encoder plus
+# keyword arguments for Image.save (formats ignore the ones they do not use)
+ENCODER_PROFILES = {
+    'default': {},
+    'fast': {'save_options': {'compress_level': 1, 'quality': 85}},
+    'small': {'save_options': {'compress_level': 9, 'optimize': True, 'quality': 90}},
+    'parallel': {'png_encoder': 'parallel'},
+}
+PARALLEL_MIN_BYTES = 1024 * 1024  # Smaller images are not worth splitting
+CHUNK_BYTES = 256 * 1024  # Raw image bytes per chunk, before filtering
+WINDOW_BYTES = 32 * 1024  # Deflate window; each chunk is primed with this much history
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Color type and bytes per pixel of the 8-bit modes the parallel writer handles
+PNG_LAYOUTS = {'L': (0, 1), 'RGB': (2, 3), 'P': (3, 1), 'LA': (4, 2), 'RGBA': (6, 4)}
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for the parallel PNG encoder: pip install numpy") from None
+    return numpy
+
+def _chunk(chunk_type, data):
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+def _zlib_header(compress_level):
+    """The two zlib header bytes zlib itself writes for this level"""
+    level_flag = 0 if compress_level < 2 else 1 if compress_level < 6 else 2 if compress_level == 6 else 3
+    header = 0x7800 | level_flag << 6
+    return struct.pack('>H', header + (31 - header % 31) % 31)
+
+def _filter_rows(numpy, rows, previous, bytes_per_pixel, adaptive):
+    """PNG-filter a (rows x row bytes) uint8 array; previous is the row above it.
+
+    Returns the filtered rows with the filter type byte in front of each.
+    """
+    if not adaptive:
+        return numpy.hstack([numpy.zeros((len(rows), 1), numpy.uint8), rows])
+
+    x = rows.astype(numpy.int16)
+    up = numpy.vstack([previous[None, :], rows[:-1]]).astype(numpy.int16)
+    left = numpy.zeros_like(x)
+    left[:, bytes_per_pixel:] = x[:, :-bytes_per_pixel]
+    upper_left = numpy.zeros_like(x)
+    upper_left[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+
+    # Paeth predictor: whichever neighbour is closest to left + up - upper_left
+    pa = numpy.abs(up - upper_left)
+    pb = numpy.abs(left - upper_left)
+    pc = numpy.abs(left + up - 2 * upper_left)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, up, upper_left))
+
+    candidates = numpy.stack([x, x - left, x - up, x - (left + up) // 2, x - paeth]).astype(numpy.uint8)
+    # Sum of absolute values with the bytes read as signed, per filter and row
+    cost = numpy.abs(candidates.view(numpy.int8).astype(numpy.int32)).sum(axis=2)
+    choice = cost.argmin(axis=0)
+
+    filtered = candidates[choice, numpy.arange(len(rows))]
+    return numpy.hstack([choice.astype(numpy.uint8)[:, None], filtered])
+
+def _compress(data, history, compress_level):
+    """Raw deflate of one chunk, primed with the data before it"""
+    options = {'zdict': history} if history else {}
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15, **options)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def _ancillary_chunks(img):
+    """PLTE, tRNS, pHYs and iCCP chunks for the image, as Pillow would write them"""
+    chunks = []
+    profile = img.info.get('icc_profile')
+    if profile:
+        chunks.append(_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(profile)))
+
+    if img.mode == 'P':
+        palette = img.getpalette('RGB') or []
+        colors = len(palette) // 3
+        chunks.append(_chunk(b'PLTE', bytes(palette[:colors * 3])))
+        transparency = img.info.get('transparency')
+        if isinstance(transparency, bytes):
+            chunks.append(_chunk(b'tRNS', transparency[:colors]))
+        elif isinstance(transparency, int) and 0 <= transparency < colors:
+            chunks.append(_chunk(b'tRNS', b'\xff' * transparency + b'\x00'))
+    elif img.mode in ('L', 'RGB') and 'transparency' in img.info:
+        transparency = img.info['transparency']
+        values = (transparency,) if img.mode == 'L' else tuple(transparency)
+        chunks.append(_chunk(b'tRNS', struct.pack(f'>{len(values)}H', *values)))
+
+    dpi = img.info.get('dpi')
+    if dpi:
+        chunks.append(_chunk(b'pHYs', struct.pack('>IIB', round(dpi[0] / 0.0254),
+                                                  round(dpi[1] / 0.0254), 1)))
+    return chunks
+
+def save_parallel_png(img, fp, threads=None, compress_level=6):
+    """Write an L, LA, RGB, RGBA or P image as a PNG to a path or binary file
+    object, using several threads"""
+    numpy = _import_numpy()
+    if img.mode not in PNG_LAYOUTS:
+        raise ValueError(f"the parallel PNG encoder cannot write {img.mode} images")
+    color_type, bytes_per_pixel = PNG_LAYOUTS[img.mode]
+    width, height = img.size
+    row_bytes = width * bytes_per_pixel
+    pixels = numpy.asarray(img).reshape(height, row_bytes)
+    adaptive = img.mode != 'P'
+
+    chunk_rows = max(1, CHUNK_BYTES // max(1, row_bytes))
+    starts = range(0, height, chunk_rows)
+
+    def filter_chunk(start):
+        previous = pixels[start - 1] if start else numpy.zeros(row_bytes, numpy.uint8)
+        return _filter_rows(numpy, pixels[start:start + chunk_rows], previous,
+                            bytes_per_pixel, adaptive).tobytes()
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+        filtered = list(executor.map(filter_chunk, starts))
+        histories = [b''] + [chunk[-WINDOW_BYTES:] for chunk in filtered[:-1]]
+        compressed = executor.map(_compress, filtered, histories,
+                                  [compress_level] * len(filtered))
+
+        checksum = 1
+        for chunk in filtered:
+            checksum = zlib.adler32(chunk, checksum)
+
+        own_file = isinstance(fp, (str, os.PathLike))
+        f = open(fp, 'wb') if own_file else fp
+        try:
+            f.write(PNG_SIGNATURE)
+            f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+            for chunk in _ancillary_chunks(img):
+                f.write(chunk)
+            f.write(_chunk(b'IDAT', _zlib_header(compress_level)))
+            for data in compressed:
+                f.write(_chunk(b'IDAT', data))
+            # An empty final block ends the deflate stream, then the zlib checksum
+            f.write(_chunk(b'IDAT', b'\x03\x00' + struct.pack('>I', checksum)))
+            f.write(_chunk(b'IEND', b''))
+        finally:
+            if own_file:
+                f.close()
+
+def image_format(fp, output_format=None, default=None):
+    """Format an image saved to fp would get: explicit, from the extension, or default"""
+    if output_format:
+        return output_format.upper()
+    if isinstance(fp, (str, os.PathLike)):
+        extension = os.path.splitext(os.fspath(fp))[1].lower()
+        return Image.registered_extensions().get(extension, default)
+    return default
+
+def encoder_profile(name):
+    """Engine keyword arguments (png_encoder, save_options) for a named profile"""
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"unknown encoder profile {name!r}; use one of {sorted(ENCODER_PROFILES)}")
+    profile = ENCODER_PROFILES[name]
+    return {'png_encoder': profile.get('png_encoder'),
+            'save_options': dict(profile.get('save_options', {}))}
+
+def save_image(img, fp, output_format=None, png_encoder=None, save_options=None):
+    """img.save(fp, format=output_format, **save_options), using the parallel
+    PNG writer for large 8-bit PNG outputs when png_encoder is 'parallel'"""
+    if png_encoder not in (None,) + PNG_ENCODERS:
+        raise ValueError(f"unknown PNG encoder {png_encoder!r}; use one of {PNG_ENCODERS}")
+    save_options = save_options or {}
+    target_format = image_format(fp, output_format)
+    if target_format == 'JPEG' and img.mode not in ('L', 'RGB', 'CMYK'):
+        # Transparency or a palette cannot be stored in a JPEG
+        img = img.convert('RGB')
+    if (png_encoder == 'parallel' and img.mode in PNG_LAYOUTS and target_format == 'PNG'
+            and img.width * img.height * len(img.getbands()) >= PARALLEL_MIN_BYTES):
+        save_parallel_png(img, fp, compress_level=save_options.get('compress_level', 6))
+    else:
+        img.save(fp, format=output_format, **save_options)
+
+def benchmark_png_encoders(img, threads=None, compress_level=6, repeat=3):
+    """Encode img with each PNG encoder; returns {encoder: {'seconds', 'bytes'}}
+    with the best time of `repeat` runs"""
+    encoders = {
+        'pillow': lambda f: img.save(f, format='PNG', compress_level=compress_level),
+        'parallel': lambda f: save_parallel_png(img, f, threads, compress_level),
+    }
+    results = {}
+    for name, encode in encoders.items():
+        best = None
+        for _ in range(repeat):
+            buffer = io.BytesIO()
+            started = time.perf_counter()
+            encode(buffer)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        results[name] = {'seconds': best, 'bytes': len(buffer.getvalue())}
+    return results
+
+def main():
+    """python -m piccropper.encoders IMAGE [THREADS]: compare the PNG encoders"""
+    if len(sys.argv) < 2:
+        print("usage: python -m piccropper.encoders IMAGE [THREADS]")
+        return 1
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    with Image.open(sys.argv[1]) as img:
+        img.load()
+        results = benchmark_png_encoders(img, threads)
+
+    print(f"{img.width}x{img.height} {img.mode}, {threads or os.cpu_count()} threads")
+    baseline = results['pillow']
+    for name, result in results.items():
+        print(f"  {name:9s} {result['seconds']:7.3f}s {result['bytes']:>12,} bytes "
+              f"({baseline['seconds'] / result['seconds']:.1f}x speed, "
+              f"{result['bytes'] / baseline['bytes']:.1%} size)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
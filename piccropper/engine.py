@@ -0,0 +1,276 @@
+"""Streaming crop engine.
+
+crop_stream() takes an iterable of image paths or file-like objects and yields
+one result dict per input as soon as it is done. Work is submitted to an
+executor lazily, with at most max_pending crops in flight, so a slow consumer
+or an endless input iterable never piles up decoded images in memory.
+"""
+from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .encoders import save_image
+from .guard import CropTimeoutError, TimeoutPool, with_retries
+from .mapped import mapped_crop
+from .tiled import (DEFAULT_PIXEL_LIMIT, IN_MEMORY_PIXEL_LIMIT, TILED_PIXEL_THRESHOLD, open_image,
+                    tiled_crop)
+import io
+import math
+import os
+import time
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+def list_image_files(input_folder):
+    """Names of all supported images in the input folder"""
+    return [f for f in os.listdir(input_folder)
+            if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+def output_name(fname):
+    """Output filename with "-cropped" before the file extension"""
+    name, ext = os.path.splitext(fname)
+    return f"{name}-cropped{ext}"
+
+def read_metadata(img):
+    """Metadata dict for an opened (not necessarily decoded) image"""
+    return {
+        'width': img.width,
+        'height': img.height,
+        'mode': img.mode,
+        'format': img.format,
+    }
+
+def target_size(crop_box, size=None, scale=None, max_edge=None):
+    """Output size after resizing a crop, or None to keep the crop's own size.
+
+    Give at most one of size (width, height), scale (factor) or max_edge
+    (longest edge in pixels; crops are never enlarged to reach it).
+    """
+    if sum(option is not None for option in (size, scale, max_edge)) > 1:
+        raise ValueError("give only one of size, scale or max_edge")
+
+    left, top, right, bottom = crop_box
+    width, height = right - left, bottom - top
+    if size is not None:
+        return tuple(size)
+    if scale is not None:
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    if max_edge is not None:
+        factor = min(1.0, max_edge / max(width, height))
+        return max(1, round(width * factor)), max(1, round(height * factor))
+    return None
+
+def fused_crop(img, crop_box, output_size=None, resample=Image.Resampling.LANCZOS):
+    """Crop an opened, not yet loaded image and resize it to output_size in one pass.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 resolution when that still leaves
+    enough pixels, and resize(box=...) with a reducing gap box-averages the
+    crop region with reduce() before the final resample, so the work scales
+    with the output size rather than the full input. Uncompressed BMP and
+    TIFF files on disk are cropped from a memory map (see mapped.py) and only
+    the crop is resized.
+    """
+    left, top, right, bottom = crop_box
+    cropped = mapped_crop(img, crop_box)
+    if output_size is None or tuple(output_size) == (right - left, bottom - top):
+        return cropped if cropped is not None else img.crop(crop_box)
+    if cropped is not None:
+        return cropped.resize(output_size, resample, reducing_gap=3.0)
+
+    if left < 0 or top < 0 or right > img.width or bottom > img.height:
+        # resize() needs the box inside the image; crop() pads the outside like before
+        return img.crop(crop_box).resize(output_size, resample, reducing_gap=3.0)
+
+    factor = min((right - left) / output_size[0], (bottom - top) / output_size[1])
+    if img.format == 'JPEG' and factor >= 2:
+        full_width, full_height = img.size
+        img.draft(img.mode, (math.ceil(full_width / factor), math.ceil(full_height / factor)))
+        scale_x, scale_y = img.width / full_width, img.height / full_height
+        crop_box = (left * scale_x, top * scale_y, right * scale_x, bottom * scale_y)
+
+    return img.resize(output_size, resample, box=crop_box, reducing_gap=3.0)
+
+def crop_one(source, crop_box, output_path=None, output_format=None, output_size=None,
+             pixel_limit=DEFAULT_PIXEL_LIMIT, png_encoder=None, save_options=None):
+    """Crop a single image and either save it to output_path or return the encoded bytes.
+
+    source is a path or raw image bytes. With output_size the crop is resized
+    in the same pass (see fused_crop). Inputs with more than pixel_limit
+    pixels are rejected; large inputs on disk are cropped band by band where
+    the format allows (see tiled.py). png_encoder 'parallel' writes large PNG
+    outputs on several threads, and save_options are passed to the encoder
+    (see encoders.py). Returns (metadata, data)
+    where data is None when the crop was written to output_path.
+    """
+    path = os.fspath(source) if isinstance(source, (str, os.PathLike)) else None
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    with open_image(source, pixel_limit) as img:
+        metadata = read_metadata(img)
+        pixels = img.width * img.height
+
+        if pixels > TILED_PIXEL_THRESHOLD:
+            data = NotImplemented
+            if path is not None:
+                data = tiled_crop(path, img, crop_box, output_path, output_format, output_size,
+                                  png_encoder, save_options)
+            if data is not NotImplemented:
+                return metadata, data
+            if pixels > IN_MEMORY_PIXEL_LIMIT:
+                raise Image.DecompressionBombError(
+                    f"image has {pixels} pixels, too many to decode in memory, and this "
+                    f"{img.format} file cannot be cropped band by band")
+
+        cropped = fused_crop(img, crop_box, output_size)
+        image_format = output_format or metadata['format']
+
+        if output_path is not None:
+            save_image(cropped, output_path, output_format, png_encoder, save_options)
+            return metadata, None
+
+        buffer = io.BytesIO()
+        save_image(cropped, buffer, image_format, png_encoder, save_options)
+        return metadata, buffer.getvalue()
+
+def _timed_crop(source, crop_box, output_path, output_format, output_size, pixel_limit,
+                png_encoder=None, save_options=None, retries=0):
+    """crop_one() with transient I/O errors retried; returns (metadata, data, seconds, attempts)"""
+    started = time.perf_counter()
+    (metadata, data), attempts = with_retries(
+        crop_one, (source, crop_box, output_path, output_format, output_size, pixel_limit,
+                   png_encoder, save_options), retries)
+    return metadata, data, time.perf_counter() - started, attempts
+
+def failure_result(source, output_path, error):
+    """Result dict for a crop that raised error"""
+    return {'source': source, 'status': 'timeout' if isinstance(error, CropTimeoutError) else 'error',
+            'output': output_path, 'data': None, 'metadata': None, 'seconds': 0.0,
+            'attempts': getattr(error, 'attempts', 1), 'error': str(error)}
+
+def _prepare(source, output_folder):
+    """Turn one input into (picklable payload, output path)"""
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        output_path = None
+        if output_folder:
+            output_path = os.path.join(output_folder, output_name(os.path.basename(path)))
+        return path, output_path
+
+    # File-like objects are read here so the work can run in another process
+    name = getattr(source, 'name', None)
+    output_path = None
+    if output_folder and isinstance(name, str):
+        output_path = os.path.join(output_folder, output_name(os.path.basename(name)))
+    return source.read(), output_path
+
+def default_max_pending(executor, max_workers):
+    """Twice the worker count, so workers never wait on the consumer"""
+    workers = max_workers or getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+    return 2 * workers
+
+def make_executor(executor, max_workers, timeout=None):
+    """(executor, whether the caller owns it): the given one, else a thread
+    pool, or a TimeoutPool of worker processes when a timeout is set"""
+    if executor is not None:
+        if timeout is not None:
+            raise ValueError("give timeout to the TimeoutPool passed as executor instead")
+        return executor, False
+    if timeout is not None:
+        return TimeoutPool(max_workers, timeout), True
+    return ThreadPoolExecutor(max_workers=max_workers), True
+
+def run_bounded(executor, jobs, max_pending):
+    """Submit (tag, fn, args) jobs lazily and yield (tag, future) as each completes.
+
+    At most max_pending jobs are submitted but not yet yielded.
+    """
+    pending = {}
+    jobs = iter(jobs)
+    exhausted = False
+
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    tag, fn, args = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[executor.submit(fn, *args)] = tag
+
+            if not pending:
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+    finally:
+        # Also reached when the consumer stops iterating early
+        for future in pending:
+            future.cancel()
+
+def crop_stream(sources, crop_box, output_folder=None, output_format=None,
+                executor=None, max_workers=None, max_pending=None,
+                size=None, scale=None, max_edge=None, pixel_limit=DEFAULT_PIXEL_LIMIT,
+                png_encoder=None, save_options=None, timeout=None, retries=0):
+    """Crop every source and yield a result dict for each one as it completes.
+
+    sources: iterable of paths or binary file-like objects, consumed lazily.
+    output_folder: where to write "<name>-cropped<ext>" files; without it (or
+        for file-like objects without a name) the result carries the encoded
+        bytes in 'data' instead.
+    executor: any concurrent.futures executor. A thread pool with max_workers
+        threads is created (and shut down) when none is given.
+    max_pending: upper bound on crops submitted but not yet yielded
+        (defaults to twice the worker count).
+    size, scale, max_edge: optionally resize every crop in the same pass
+        (see target_size).
+    pixel_limit: inputs with more pixels are reported as errors; replaces
+        Pillow's global MAX_IMAGE_PIXELS guard.
+    png_encoder: 'pillow' (default) or 'parallel' to deflate large PNG
+        outputs on several threads; best with few workers and big images.
+    save_options: keyword arguments for Image.save, such as compress_level
+        or quality (see encoders.ENCODER_PROFILES).
+    timeout: wall-clock seconds allowed per file. Crops then run in worker
+        processes, and a worker that overruns is killed and replaced (see
+        guard.TimeoutPool). Pass a TimeoutPool as executor to share one.
+    retries: how often to retry a file after a transient I/O error.
+
+    Each result has 'source', 'status' ('ok', 'error' or 'timeout'),
+    'output', 'data', 'metadata', 'seconds', 'attempts' and 'error'.
+    """
+    crop_box = tuple(crop_box)
+    output_size = target_size(crop_box, size, scale, max_edge)
+    executor, own_executor = make_executor(executor, max_workers, timeout)
+    if max_pending is None:
+        max_pending = default_max_pending(executor, max_workers)
+
+    failed = []
+
+    def jobs():
+        for source in sources:
+            try:
+                payload, output_path = _prepare(source, output_folder)
+            except Exception as e:
+                failed.append(failure_result(source, None, e))
+                continue
+            yield (source, output_path), _timed_crop, (payload, crop_box, output_path,
+                                                       output_format, output_size, pixel_limit,
+                                                       png_encoder, save_options, retries)
+
+    try:
+        for (source, output_path), future in run_bounded(executor, jobs(), max_pending):
+            while failed:
+                yield failed.pop(0)
+            try:
+                metadata, data, seconds, attempts = future.result()
+            except Exception as e:
+                yield failure_result(source, output_path, e)
+            else:
+                yield {'source': source, 'status': 'ok', 'output': output_path, 'data': data,
+                       'metadata': metadata, 'seconds': seconds, 'attempts': attempts,
+                       'error': None}
+        while failed:
+            yield failed.pop(0)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
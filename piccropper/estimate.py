@@ -0,0 +1,328 @@
+"""Dry-run cost estimates: wall time and output size of a batch before it runs.
+
+The pre-flight scan already knows the format, mode and dimensions of every
+input. estimate_run() sorts the files into buckets of the same format and
+mode and of similar decoding work (pixels the crop has to decode, which for
+very large inputs read band by band is only the rows down to the crop), and
+adds timed trial crops of a small sample drawn from those buckets. The
+sample is weighted by the work of each bucket, so a handful of huge files
+is sampled ahead of many small ones, and it runs with the same worker count,
+encoder settings and timeout as the real run, so the measured times include
+the contention of that many workers. Per-bucket times per decoded megapixel
+and output sizes are extrapolated to every file of the bucket; buckets left
+out of the sample borrow them from sampled files of the same format.
+
+Ranges combine the file-to-file spread seen in the sample with the
+uncertainty of each mean, as a rough 90% interval; times also carry a fixed
+relative uncertainty, since a short trial never times a long run exactly.
+print_comparison() sets a saved estimate against the actual run, so later
+estimates can be judged.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from .engine import crop_stream
+from .storage import DEFAULT_TRANSFER_WORKERS, _Download
+from .tiled import PNG_BYTES_PER_PIXEL, TILED_PIXEL_THRESHOLD
+import json
+import math
+import os
+import time
+
+Z_90 = 1.645  # Half-width of a two-sided 90% normal interval, in standard deviations
+SINGLE_SAMPLE_SPREAD = 0.3  # Relative file-to-file spread assumed when a group has one sample
+BORROWED_SPREAD = 0.5  # Relative uncertainty of costs borrowed from other groups
+# Relative uncertainty of any timing taken from a short trial (caches, contention,
+# other load on the machine), however uniform the sampled files are
+TIMING_SPREAD = 0.15
+MAX_SAMPLES = 48
+BUCKETS_PER_DOUBLING = 2  # Files whose decoding work differs by less than this share a bucket
+
+def default_estimate_name(shard):
+    if shard is None:
+        return 'estimate.json'
+    index, count = shard
+    return f"estimate-shard-{index}-of-{count}.json"
+
+def default_workers(options):
+    """Worker count crop_stream() uses for these options when none is given"""
+    if options.get('max_workers'):
+        return options['max_workers']
+    if options.get('timeout'):
+        return os.cpu_count() or 1  # TimeoutPool default
+    return min(32, (os.cpu_count() or 1) + 4)  # ThreadPoolExecutor default
+
+def work_pixels(key, crop_box):
+    """Pixels a crop decodes from one file of a pre-flight group (width, height, mode, format).
+
+    Inputs above TILED_PIXEL_THRESHOLD are read band by band where the format
+    allows: TIFF and BMP files only at the crop's rows, PNGs from the top down
+    to the crop's last row. Everything else is decoded whole.
+    """
+    width, height, mode, image_format = key
+    left, top, right, bottom = crop_box
+    if width * height > TILED_PIXEL_THRESHOLD:
+        if image_format in ('TIFF', 'BMP'):
+            return (right - left) * (bottom - top)
+        if image_format == 'PNG' and mode in PNG_BYTES_PER_PIXEL:
+            return width * bottom
+    return width * height
+
+def stratified_sample(groups, sample_size, weights=None):
+    """Pick about sample_size files spread over groups of files.
+
+    Every group gets one file while the budget lasts, heaviest first, and the
+    rest are shared out in proportion to weight. weights maps each group to
+    its expected cost, e.g. the pixels of all its files (default: its file
+    count), so expensive groups are sampled even when they hold a single
+    file. Files are taken evenly spaced through each group in the order
+    given. Returns {group: [fname, ...]}.
+    """
+    weights = weights or {key: len(fnames) for key, fnames in groups.items()}
+    ordered = sorted(groups.items(), key=lambda item: -weights[item[0]])
+    budget = min(sample_size, sum(len(fnames) for _, fnames in ordered))
+    counts = {key: 0 for key, _ in ordered}
+    for key, _ in ordered[:budget]:
+        counts[key] = 1
+    for _ in range(budget - sum(counts.values())):
+        key, _ = max((item for item in ordered if counts[item[0]] < len(item[1])),
+                     key=lambda item: weights[item[0]] / (counts[item[0]] + 1))
+        counts[key] += 1
+
+    sample = {}
+    for key, fnames in ordered:
+        k = counts[key]
+        if k:
+            sample[key] = [fnames[(2 * i + 1) * len(fnames) // (2 * k)] for i in range(k)]
+    return sample
+
+def _measured_cost(values, count):
+    """(expected total, variance) for count files whose sampled costs are values"""
+    n = len(values)
+    mean = sum(values) / n
+    if n > 1:
+        sd = math.sqrt(sum((value - mean) ** 2 for value in values) / (n - 1))
+    else:
+        sd = mean * SINGLE_SAMPLE_SPREAD
+    # Spread of a sum of count files, plus the uncertainty of the mean itself
+    return count * mean, count * sd ** 2 + (count * sd) ** 2 / n
+
+def _borrowed_cost(mean, count):
+    """(expected total, variance) for count files costed from other groups"""
+    return count * mean, (count * (mean * SINGLE_SAMPLE_SPREAD) ** 2
+                          + (count * mean * BORROWED_SPREAD) ** 2)
+
+def _interval(expected, variance):
+    half_width = Z_90 * math.sqrt(variance)
+    return [max(0.0, expected - half_width), expected, expected + half_width]
+
+def _fetch_sample(storage, names):
+    """Download the sample concurrently; returns (sources, bytes, seconds)"""
+    def fetch(name):
+        try:
+            return storage.read(name)
+        except Exception:
+            return None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=DEFAULT_TRANSFER_WORKERS) as transfers:
+        data = list(transfers.map(fetch, names))
+    seconds = time.perf_counter() - started
+    sources = [_Download(name, d) for name, d in zip(names, data) if d is not None]
+    return sources, sum(len(d) for d in data if d is not None), seconds
+
+def estimate_run(input_folder, image_files, report, crop_box, options=None, sample_size=None,
+                 storage=None):
+    """Estimate the wall time and output bytes of cropping image_files.
+
+    report: the preflight_scan() report of the files; files it could not
+        read or that the crop box does not fit are left out.
+    options: the keyword arguments the real run passes to crop_stream()
+        (max_workers, timeout, png_encoder, save_options, resize, ...).
+    sample_size: trial crops to run (default: twice the worker count, at
+        least 8 and at most MAX_SAMPLES).
+    storage: where the files are (see storage.open_storage); remote samples
+        are downloaded first, which also measures the transfer rate.
+
+    Returns a dict whose 'seconds' and 'output_bytes' are [low, expected,
+    high], plus the per-group figures and the trial details.
+    """
+    options = dict(options or {})
+    workers = default_workers(options)
+    wanted = set(image_files) - set(report['out_of_bounds'])
+    # Bucket the pre-flight groups by format, mode and decoding work
+    work = {}
+    buckets = {}
+    for key, fnames in report['groups'].items():
+        width, height, mode, image_format = key
+        pixels = work_pixels(key, crop_box)
+        bucket = (image_format, mode, round(BUCKETS_PER_DOUBLING * math.log2(max(1, pixels))))
+        for fname in fnames:
+            if fname in wanted:
+                work[fname] = (width * height, pixels)
+                buckets.setdefault(bucket, []).append(fname)
+    for fnames in buckets.values():
+        fnames.sort(key=lambda fname: (work[fname][1], fname))
+
+    weights = {bucket: sum(work[fname][1] for fname in fnames)
+               for bucket, fnames in buckets.items()}
+    sample = stratified_sample(buckets, sample_size or min(MAX_SAMPLES, max(8, 2 * workers)),
+                               weights)
+    names = [fname for fnames in sample.values() for fname in fnames]
+    downloaded, download_seconds = 0, 0.0
+    if storage is not None and any(storage.local_path(name) is None for name in names):
+        sources, downloaded, download_seconds = _fetch_sample(storage, names)
+    else:
+        sources = [storage.local_path(name) if storage else os.path.join(input_folder, name)
+                   for name in names]
+
+    started = time.perf_counter()
+    measured = {}
+    spans = []
+    failed = 0
+    for result in crop_stream(sources, crop_box, None, None, **options):
+        if result['status'] != 'ok':
+            failed += 1
+            continue
+        finished = time.perf_counter()
+        source = result['source']
+        name = os.path.basename(source) if isinstance(source, str) else source.name
+        measured[name] = (result['seconds'], len(result['data']))
+        spans.append((finished - result['seconds'], finished))
+    trial_seconds = time.perf_counter() - started
+    if not measured:
+        raise ValueError("no trial crop succeeded, so there is nothing to extrapolate from")
+
+    # Workers busy on average while the trial crops ran (not counting worker
+    # start-up); per-file times were measured under the same contention, so
+    # their sum divided by this gives wall time
+    busy = sum(seconds for seconds, _ in measured.values())
+    window = max(end for _, end in spans) - min(start for start, _ in spans)
+    concurrency = min(workers, max(1.0, busy / window)) if window > 0 else 1.0
+
+    # Seconds per decoded megapixel and output bytes of every trial crop
+    rates = {}
+    for (image_format, _, _), fnames in sample.items():
+        for fname in fnames:
+            if fname in measured:
+                seconds, size = measured[fname]
+                rates.setdefault(image_format, []).append((seconds * 1e6 / work[fname][1], size))
+    all_rates = [rate for format_rates in rates.values() for rate in format_rates]
+
+    worker_seconds = [0.0, 0.0]
+    output_bytes = [0.0, 0.0]
+    group_rows = []
+    for bucket, fnames in sorted(buckets.items(), key=lambda item: -weights[item[0]]):
+        image_format, mode, _ = bucket
+        megapixels = sum(work[fname][0] for fname in fnames) / len(fnames) / 1e6
+        work_megapixels = weights[bucket] / len(fnames) / 1e6
+        samples = [(measured[fname][0] * 1e6 / work[fname][1], measured[fname][1])
+                   for fname in sample.get(bucket, []) if fname in measured]
+        if samples:
+            seconds = _measured_cost([r * work_megapixels for r, _ in samples], len(fnames))
+            size = _measured_cost([b for _, b in samples], len(fnames))
+        else:
+            borrowed = rates.get(image_format) or all_rates
+            seconds = _borrowed_cost(sum(r for r, _ in borrowed) / len(borrowed)
+                                     * work_megapixels, len(fnames))
+            size = _borrowed_cost(sum(b for _, b in borrowed) / len(borrowed), len(fnames))
+        for total, (expected, variance) in ((worker_seconds, seconds), (output_bytes, size)):
+            total[0] += expected
+            total[1] += variance
+        group_rows.append({'format': image_format, 'mode': mode, 'files': len(fnames),
+                           'megapixels': megapixels, 'work_megapixels': work_megapixels,
+                           'sampled': len(samples),
+                           'seconds_per_file': seconds[0] / len(fnames),
+                           'bytes_per_file': size[0] / len(fnames)})
+
+    worker_seconds = _interval(worker_seconds[0],
+                               worker_seconds[1] + (worker_seconds[0] * TIMING_SPREAD) ** 2)
+    wall = [seconds / concurrency for seconds in worker_seconds]
+    transfer_seconds = None
+    if downloaded:
+        # Downloads overlap the crops, so whichever is slower sets the pace
+        input_bytes = sum(storage.size(fname) for fname in work)
+        transfer_seconds = input_bytes * download_seconds / downloaded
+        wall = [max(seconds, transfer_seconds) for seconds in wall]
+
+    return {
+        'files': len(work),
+        'crop_box': list(crop_box),
+        'workers': workers,
+        'png_encoder': options.get('png_encoder') or 'pillow',
+        'save_options': options.get('save_options') or {},
+        'sampled': len(measured),
+        'failed_samples': failed,
+        'trial_seconds': trial_seconds,
+        'concurrency': concurrency,
+        'worker_seconds': worker_seconds,
+        'transfer_seconds': transfer_seconds,
+        'seconds': wall,
+        'output_bytes': _interval(*output_bytes),
+        'groups': group_rows,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def format_seconds(seconds):
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds // 60 % 60:02d}m"
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def print_estimate(estimate):
+    """Print a dry-run estimate to the console"""
+    print(f"Dry-run estimate for {estimate['files']} files ({estimate['sampled']} trial crops, "
+          f"{estimate['workers']} workers, {estimate['png_encoder']} PNG encoder):")
+    for group in estimate['groups']:
+        decoded = (f" ({group['work_megapixels']:.1f} MP decoded)"
+                   if group['work_megapixels'] < group['megapixels'] else "")
+        print(f"  {group['files']:6d} x {group['format']} {group['mode']} "
+              f"~{group['megapixels']:.1f} MP{decoded}: {group['seconds_per_file']:.3f}s, "
+              f"{format_bytes(group['bytes_per_file'])} per file "
+              f"({group['sampled'] or 'none'} sampled)")
+    if estimate['failed_samples']:
+        print(f"  Trial crops that failed: {estimate['failed_samples']}")
+
+    low, expected, high = estimate['seconds']
+    print(f"  Wall time:   {format_seconds(expected)} "
+          f"({format_seconds(low)} - {format_seconds(high)})")
+    low, expected, high = estimate['output_bytes']
+    print(f"  Output size: {format_bytes(expected)} ({format_bytes(low)} - {format_bytes(high)})")
+    if estimate['transfer_seconds'] is not None:
+        print(f"  Downloads alone: {format_seconds(estimate['transfer_seconds'])}")
+    print("  Ranges are rough 90% intervals from the spread of the trial crops.")
+
+def print_comparison(estimate, actual):
+    """Print how a run's actual 'seconds' and 'output_bytes' compare to its estimate"""
+    print("Estimate vs. actual:")
+    for label, key, fmt in (('Wall time:  ', 'seconds', format_seconds),
+                            ('Output size:', 'output_bytes', format_bytes)):
+        low, expected, high = estimate[key]
+        value = actual[key]
+        if value < low:
+            verdict = "below the range"
+        elif value > high:
+            verdict = "above the range"
+        else:
+            verdict = "within the range"
+        error = f" ({(value - expected) / expected:+.0%})" if expected else ""
+        print(f"  {label} {fmt(value)} actual, {fmt(expected)} estimated{error}, {verdict} "
+              f"{fmt(low)} - {fmt(high)}")
+    if actual['files'] != estimate['files']:
+        print(f"  The estimate covered {estimate['files']} files; {actual['files']} were cropped.")
+
+def save_estimate(storage, name, estimate):
+    storage.write(name, json.dumps(estimate, indent=1).encode('utf-8'))
+
+def load_estimate(storage, name):
+    """A saved estimate, or None if there is none"""
+    if not storage.exists(name):
+        return None
+    return json.loads(storage.read(name))
@@ -0,0 +1,356 @@
+"""Keep bad inputs from stalling a batch: timeouts, retries and quarantine.
+
+A truncated or crafted image can make a decoder spin forever, and a thread
+running it can never be stopped. TimeoutPool is a concurrent.futures
+executor whose workers are separate processes: a task that overruns its
+wall-clock timeout fails with CropTimeoutError, and its worker is killed and
+replaced, so one hanging file costs one timeout instead of a worker for the
+rest of the run. A worker that dies (for example a crash inside a decoder)
+fails its task with WorkerCrashedError and is replaced the same way.
+
+is_transient() tells passing I/O trouble (network filesystems, busy devices)
+apart from broken files, so only the former is retried. quarantine_files()
+moves inputs that failed for good out of the way, with the reasons.
+"""
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from multiprocessing.connection import wait
+from multiprocessing.reduction import ForkingPickler
+import collections
+import errno
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+# errno values of I/O errors that may well succeed when tried again
+TRANSIENT_ERRNOS = {errno.EIO, errno.EAGAIN, errno.EINTR, errno.ETIMEDOUT, errno.EBUSY,
+                    errno.ECONNRESET, getattr(errno, 'ESTALE', errno.EIO)}
+DEFAULT_RETRIES = 2
+RETRY_DELAY = 0.5  # Seconds before the first retry; doubled for every further one
+STARTUP_TIMEOUT = 60.0  # Seconds a worker may take to start (spawn, imports) before its task runs
+STARTED = 'started'  # Sent by a worker when it has unpickled a task and is about to run it
+QUARANTINE_LIST = 'quarantine.json'
+STALE_LOCK_SECONDS = 300  # A lock file this old was left behind by a killed process
+
+class CropTimeoutError(Exception):
+    """A task ran longer than the pool's timeout and its worker was killed"""
+
+class WorkerCrashedError(Exception):
+    """The worker process running a task died without returning a result"""
+
+def is_transient(error):
+    """Whether an exception looks like a passing I/O error worth retrying.
+
+    Pillow reports broken image data as OSError without an errno, so those
+    are never retried.
+    """
+    if isinstance(error, (CropTimeoutError, WorkerCrashedError)):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS
+
+def with_retries(fn, args, retries=0, delay=RETRY_DELAY):
+    """Call fn(*args), retrying transient I/O errors up to `retries` times.
+
+    Returns (result, attempts). An exception that is finally raised carries
+    the number of attempts made in its `attempts` attribute.
+    """
+    attempt = 1
+    while True:
+        try:
+            return fn(*args), attempt
+        except Exception as e:
+            if attempt > retries or not is_transient(e):
+                e.attempts = attempt
+                raise
+        time.sleep(delay * 2 ** (attempt - 1))
+        attempt += 1
+
+def _worker(conn):
+    """Run (fn, args) tasks sent over conn until None arrives"""
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args = task
+        conn.send(STARTED)
+        try:
+            reply = (True, fn(*args))
+        except BaseException as e:
+            reply = (False, _portable_error(e))
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The result could not be pickled
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+def _portable_error(error):
+    """error if it survives a pickle round trip, else a RuntimeError with its repr.
+
+    Exceptions with required constructor arguments pickle fine but fail to
+    unpickle on the other side, so only a full round trip proves it.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(repr(error))
+    return error
+
+class TimeoutPool(Executor):
+    """Process pool that kills and replaces a worker whose task exceeds `timeout` seconds.
+
+    Functions and arguments must be picklable, as with ProcessPoolExecutor.
+    Workers are started on demand with the 'spawn' method by default. The
+    timeout runs from the moment the worker starts on the task, so process
+    start-up and imports do not count against it (they get STARTUP_TIMEOUT);
+    everything the task does, including any retries and their back-off
+    inside it, shares the one budget. A worker found dead while idle is
+    replaced before it is given a task.
+    """
+    def __init__(self, max_workers=None, timeout=None, mp_context=None):
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._context = mp_context or multiprocessing.get_context('spawn')
+        self._queue = collections.deque()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._wake_reader, self._wake_writer = self._context.Pipe(duplex=False)
+        self._dispatcher = None
+        self._shutdown = False
+        self.recycled = 0  # Workers replaced after a timeout or crash
+
+    def submit(self, fn, /, *args, **kwargs):
+        if kwargs:
+            raise TypeError("TimeoutPool.submit takes positional arguments only")
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit to a pool that was shut down")
+            self._queue.append((future, fn, args))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+                self._dispatcher.start()
+        self._wake()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    self._queue.popleft()[0].cancel()
+        self._wake()
+        if wait and self._dispatcher is not None:
+            self._dispatcher.join()
+
+    def _wake(self):
+        self._wake_writer.send_bytes(b'')
+
+    def _start_worker(self):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker = {'process': process, 'conn': parent_conn, 'future': None, 'deadline': None,
+                  'started': False}
+        self._workers.append(worker)
+        return worker
+
+    def _retire(self, worker, error=None):
+        """Kill a worker; fail its task with error, if given. Retiring twice is harmless."""
+        if worker not in self._workers:
+            return
+        self._workers.remove(worker)
+        worker['process'].kill()
+        worker['process'].join()
+        worker['conn'].close()
+        future, worker['future'], worker['deadline'] = worker['future'], None, None
+        if error is not None and future is not None:
+            self.recycled += 1
+            future.set_exception(error)
+
+    def _idle_worker(self):
+        """An idle worker that is still alive, retiring any that died while idle"""
+        for worker in list(self._workers):
+            if worker['future'] is None:
+                if worker['process'].is_alive():
+                    return worker
+                self._retire(worker)
+        return None
+
+    def _assign(self):
+        """Hand queued tasks to idle workers, starting workers up to the limit"""
+        with self._lock:
+            while self._queue:
+                idle = self._idle_worker()
+                if idle is None and len(self._workers) >= self._max_workers:
+                    return
+                future, fn, args = self._queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    task = bytes(ForkingPickler.dumps((fn, args)))
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                worker = idle or self._start_worker()
+                try:
+                    worker['conn'].send_bytes(task)
+                except OSError:
+                    # The worker died since the check; hand the task to a fresh one
+                    self._retire(worker)
+                    worker = self._start_worker()
+                    try:
+                        worker['conn'].send_bytes(task)
+                    except OSError as e:
+                        self._retire(worker)
+                        future.set_exception(WorkerCrashedError(f"could not start a worker: {e}"))
+                        continue
+                worker['future'] = future
+                worker['started'] = False
+                if self.timeout is not None:
+                    # Replaced by the task's own deadline when the worker reports it started
+                    worker['deadline'] = time.monotonic() + STARTUP_TIMEOUT
+
+    def _dispatch(self):
+        while True:
+            self._assign()
+            busy = [w for w in self._workers if w['future'] is not None]
+            with self._lock:
+                if self._shutdown and not busy and not self._queue:
+                    break
+
+            deadlines = [w['deadline'] for w in busy if w['deadline'] is not None]
+            wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            ready = wait([self._wake_reader] + [w['conn'] for w in busy], wait_for)
+
+            for conn in ready:
+                if conn is self._wake_reader:
+                    while self._wake_reader.poll():
+                        self._wake_reader.recv_bytes()
+                    continue
+                worker = next(w for w in busy if w['conn'] is conn)
+                try:
+                    reply = conn.recv()
+                except (EOFError, OSError):
+                    worker['process'].join()
+                    self._retire(worker, WorkerCrashedError(
+                        f"worker process exited with code {worker['process'].exitcode}"))
+                    continue
+                except Exception as e:
+                    # The reply arrived but could not be unpickled; only its task fails
+                    reply = (False, RuntimeError(f"unreadable result: {type(e).__name__}: {e}"))
+                if reply == STARTED:
+                    worker['started'] = True
+                    if self.timeout is not None:
+                        worker['deadline'] = time.monotonic() + self.timeout
+                    continue
+                ok, value = reply
+                future, worker['future'], worker['deadline'] = worker['future'], None, None
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+            now = time.monotonic()
+            for worker in busy:
+                if worker in self._workers and worker['future'] is not None \
+                        and worker['deadline'] is not None and now >= worker['deadline']:
+                    if worker['started']:
+                        error = CropTimeoutError(
+                            f"no result after {self.timeout:g} seconds; worker restarted")
+                    else:
+                        error = CropTimeoutError(
+                            f"worker did not start within {STARTUP_TIMEOUT:g} seconds")
+                    self._retire(worker, error)
+
+        for worker in list(self._workers):
+            try:
+                worker['conn'].send(None)
+            except OSError:
+                pass
+            worker['process'].join(timeout=5)
+            self._retire(worker)
+
+@contextmanager
+def _file_lock(path):
+    """Hold path + '.lock' exclusively, waiting while another process holds it"""
+    lock_path = path + '.lock'
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # Released in the meantime
+            time.sleep(0.05)
+    os.close(fd)
+    try:
+        yield
+    finally:
+        os.remove(lock_path)
+
+def quarantine_files(input_folder, entries, quarantine_folder):
+    """Move the input files of failed manifest entries into quarantine_folder.
+
+    The reason for each file is appended to quarantine.json in that folder,
+    and each moved entry gets a 'quarantined' field with its new path.
+    Shards running at the same time may share quarantine_folder: a lock file
+    serialises them. Returns the number of files moved.
+    """
+    failed = [entry for entry in entries if entry['status'] in ('error', 'timeout')]
+    if not failed:
+        return 0
+    os.makedirs(quarantine_folder, exist_ok=True)
+    list_path = os.path.join(quarantine_folder, QUARANTINE_LIST)
+    with _file_lock(list_path):
+        return _quarantine_locked(input_folder, failed, quarantine_folder, list_path)
+
+def _quarantine_locked(input_folder, failed, quarantine_folder, list_path):
+    records = []
+    if os.path.exists(list_path):
+        with open(list_path) as f:
+            records = json.load(f)
+
+    moved = 0
+    for entry in failed:
+        source = os.path.join(input_folder, entry['file'])
+        if not os.path.exists(source):
+            continue
+        name, ext = os.path.splitext(entry['file'])
+        target = os.path.join(quarantine_folder, entry['file'])
+        counter = 1
+        while os.path.exists(target):
+            target = os.path.join(quarantine_folder, f"{name}-{counter}{ext}")
+            counter += 1
+        shutil.move(source, target)
+        entry['quarantined'] = target
+        records.append({'file': entry['file'], 'source': os.path.abspath(source),
+                        'quarantined': os.path.abspath(target), 'status': entry['status'],
+                        'reason': entry.get('error'),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')})
+        moved += 1
+
+    fd, tmp_path = tempfile.mkstemp(dir=quarantine_folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(records, f, indent=1)
+        os.replace(tmp_path, list_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return moved
@@ -0,0 +1,257 @@
+"""Job files: many folder/crop-box pairs cropped by one shared worker pool.
+
+A job file (JSON, or TOML on Python 3.11+ or with tomli installed) lists any
+number of jobs, each with its own input and output folder, one or more crop
+boxes, output format and encoder profile:
+
+    {
+        "max_workers": 8,
+        "max_per_job": 4,
+        "defaults": {"encoder": "fast"},
+        "jobs": [
+            {"input": "scans/a", "output": "crops/a", "crop_box": [222, 141, 752, 803]},
+            {"name": "b", "input": "scans/b", "output": "crops/b",
+             "crop_boxes": [[0, 0, 500, 500], [500, 0, 1000, 500]],
+             "format": "JPEG", "max_concurrent": 2, "max_edge": 400}
+        ]
+    }
+
+Relative folders are resolved against the job file's directory. run_jobs()
+crops every file of every job through a single executor, with at most
+max_workers crops in flight overall and at most max_concurrent per job, so
+hundreds of small folders share one pool instead of each paying for their own.
+"""
+from PIL import Image
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from .encoders import encoder_profile
+from .engine import (_timed_crop, failure_result, list_image_files, make_executor, output_name,
+                     target_size)
+from .sharding import default_manifest_path
+from .tiled import DEFAULT_PIXEL_LIMIT
+import json
+import os
+
+JOB_KEYS = {'name', 'input', 'output', 'crop_box', 'crop_boxes', 'format', 'encoder', 'size',
+            'scale', 'max_edge', 'pixel_limit', 'max_concurrent', 'manifest'}
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'BMP': '.bmp', 'GIF': '.gif',
+                     'TIFF': '.tif', 'WEBP': '.webp'}
+DEFAULT_JOB_FILE = 'crop-jobs.json'
+
+def _load_toml(path):
+    try:
+        import tomllib
+    except ImportError:
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise ImportError("TOML job files need Python 3.11+ or tomli: pip install tomli") from None
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+def _crop_box(value, name):
+    try:
+        left, top, right, bottom = (int(v) for v in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"job {name!r}: a crop box must be [left, top, right, bottom], got {value!r}")
+    if right <= left or bottom <= top:
+        raise ValueError(f"job {name!r}: crop box {value!r} is empty")
+    return left, top, right, bottom
+
+def normalize_job(job, base_folder='.'):
+    """Check one job dict and fill in its name, absolute folders and crop_boxes list"""
+    name = job.get('name') or job.get('input')
+    unknown = set(job) - JOB_KEYS
+    if unknown:
+        raise ValueError(f"job {name!r}: unknown keys {sorted(unknown)}")
+    for key in ('input', 'output'):
+        if not job.get(key):
+            raise ValueError(f"job {name!r}: '{key}' folder is required")
+        if '://' in str(job[key]):
+            raise ValueError(f"job {name!r}: '{key}' must be a local folder; "
+                             f"run storage URLs with --input/--output")
+    if ('crop_box' in job) == ('crop_boxes' in job):
+        raise ValueError(f"job {name!r}: give exactly one of 'crop_box' or 'crop_boxes'")
+
+    boxes = [job['crop_box']] if 'crop_box' in job else job['crop_boxes']
+    normalized = dict(job, name=name,
+                      input=os.path.join(base_folder, job['input']),
+                      output=os.path.join(base_folder, job['output']),
+                      crop_boxes=[_crop_box(box, name) for box in boxes])
+    normalized.pop('crop_box', None)
+    if normalized.get('format'):
+        normalized['format'] = normalized['format'].upper()
+    if normalized.get('manifest'):
+        normalized['manifest'] = os.path.join(base_folder, normalized['manifest'])
+
+    # Fail on bad resize or encoder settings now rather than once per file
+    for box in normalized['crop_boxes']:
+        target_size(box, normalized.get('size'), normalized.get('scale'), normalized.get('max_edge'))
+    encoder_profile(normalized.get('encoder', 'default'))
+    return normalized
+
+def load_job_file(path):
+    """Read a JSON or TOML job file; returns (jobs, settings) with every job normalized.
+
+    settings holds the file's max_workers, max_per_job, timeout and retries
+    (None when unset). Jobs must not share an output folder or manifest,
+    since their crops and manifests would overwrite each other.
+    """
+    if path.lower().endswith('.toml'):
+        spec = _load_toml(path)
+    else:
+        with open(path) as f:
+            spec = json.load(f)
+
+    if not isinstance(spec.get('jobs'), list) or not spec['jobs']:
+        raise ValueError(f"{path}: no jobs listed")
+    defaults = spec.get('defaults', {})
+    base_folder = os.path.dirname(os.path.abspath(path))
+    jobs = [normalize_job(dict(defaults, **job), base_folder) for job in spec['jobs']]
+
+    names = [job['name'] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"{path}: job names must be unique, repeated: {duplicates}")
+    claimed = {}
+    for job in jobs:
+        manifest = job.get('manifest') or default_manifest_path(job['output'], None)
+        for what, target in (('output folder', job['output']), ('manifest', manifest)):
+            key = (what, os.path.normcase(os.path.abspath(target)))
+            if key in claimed:
+                raise ValueError(f"{path}: jobs {claimed[key]!r} and {job['name']!r} both use "
+                                 f"{target} as their {what}; give each job its own")
+            claimed[key] = job['name']
+    settings = {key: spec.get(key) for key in ('max_workers', 'max_per_job', 'timeout', 'retries')}
+    return jobs, settings
+
+def add_job(path, job):
+    """Append a job to a JSON job file (created if missing), replacing any job of the same name"""
+    spec = {'jobs': []}
+    if os.path.exists(path):
+        with open(path) as f:
+            spec = json.load(f)
+    job = dict(job, name=job.get('name') or job['input'])
+    spec['jobs'] = [existing for existing in spec.get('jobs', [])
+                    if (existing.get('name') or existing.get('input')) != job['name']] + [job]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(spec, f, indent=1)
+    os.replace(tmp_path, path)
+
+def job_output_name(fname, box_index, box_count, output_format=None):
+    """"<name>-cropped<ext>", numbered per crop box when a job has several,
+    with the extension of output_format if one is set"""
+    name, ext = os.path.splitext(output_name(fname))
+    if box_count > 1:
+        name = f"{name}-{box_index + 1}"
+    if output_format:
+        ext = FORMAT_EXTENSIONS.get(output_format) or next(
+            (extension for extension, known in Image.registered_extensions().items()
+             if known == output_format), ext)
+    return name + ext
+
+def _job_tasks(job, retries=0, skip=()):
+    """(source, crop box index, output path, args for _timed_crop) for every crop of a job
+    except the (source, crop box index) pairs in skip"""
+    image_files = sorted(list_image_files(job['input']))
+    os.makedirs(job['output'], exist_ok=True)
+    options = encoder_profile(job.get('encoder', 'default'))
+    boxes = job['crop_boxes']
+    for fname in image_files:
+        source = os.path.join(job['input'], fname)
+        for index, box in enumerate(boxes):
+            if (source, index) in skip:
+                continue
+            output_path = os.path.join(job['output'],
+                                       job_output_name(fname, index, len(boxes), job.get('format')))
+            output_size = target_size(box, job.get('size'), job.get('scale'), job.get('max_edge'))
+            yield source, index, output_path, (
+                source, box, output_path, job.get('format'), output_size,
+                job.get('pixel_limit', DEFAULT_PIXEL_LIMIT),
+                options['png_encoder'], options['save_options'], retries)
+
+def run_jobs(jobs, executor=None, max_workers=None, max_per_job=None, timeout=None, retries=0,
+             skip=()):
+    """Crop every job through one executor and yield a result dict per crop.
+
+    At most max_workers crops (default: the executor's worker count) are in
+    flight at once, and at most max_per_job of them (or the job's own
+    'max_concurrent') belong to the same job. Jobs take turns submitting, so
+    a large folder cannot hold up the small ones queued behind it. timeout
+    and retries work as in crop_stream(). skip holds (source path, crop box
+    index) pairs not to crop, e.g. those that failed the pre-flight check.
+
+    Results follow crop_stream() ('source', 'status', 'output', 'metadata',
+    'seconds', 'attempts', 'error'; 'data' is always None) plus 'job' (the job dict),
+    'box' (crop box index) and 'job_done', True on the last result of a job.
+    """
+    executor, own_executor = make_executor(executor, max_workers, timeout)
+    global_limit = max_workers or getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+
+    tasks = [_job_tasks(job, retries, skip) for job in jobs]
+    limits = [job.get('max_concurrent') or max_per_job or global_limit for job in jobs]
+    running = [0] * len(jobs)
+    upcoming = [None] * len(jobs)
+    active = deque(range(len(jobs)))
+    pending = {}
+    errors = []
+
+    def advance(index):
+        """Look one crop ahead, so a job is known to be done with its last result"""
+        try:
+            upcoming[index] = next(tasks[index], None)
+        except Exception as e:
+            # An unreadable input folder fails its job, not the whole run
+            upcoming[index] = None
+            errors.append(dict(failure_result(jobs[index]['input'], None, e), job=jobs[index],
+                               box=None, job_done=running[index] == 0))
+        if upcoming[index] is None:
+            active.remove(index)
+
+    def submit_next():
+        """Submit one crop from the next job in turn that is below its limit"""
+        for _ in range(len(active)):
+            index = active[0]
+            active.rotate(-1)
+            if running[index] < limits[index]:
+                source, box, output_path, args = upcoming[index]
+                pending[executor.submit(_timed_crop, *args)] = (index, source, box, output_path)
+                running[index] += 1
+                advance(index)
+                return True
+        return False
+
+    try:
+        for index in range(len(jobs)):
+            advance(index)
+
+        while pending or active or errors:
+            while len(pending) < global_limit and active and submit_next():
+                pass
+            while errors:
+                yield errors.pop(0)
+            if not pending:
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, source, box, output_path = pending.pop(future)
+                running[index] -= 1
+                try:
+                    metadata, _, seconds, attempts = future.result()
+                except Exception as e:
+                    result = failure_result(source, output_path, e)
+                else:
+                    result = {'source': source, 'status': 'ok', 'output': output_path,
+                              'data': None, 'metadata': metadata, 'seconds': seconds,
+                              'attempts': attempts, 'error': None}
+                result.update(job=jobs[index], box=box,
+                              job_done=running[index] == 0 and upcoming[index] is None)
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
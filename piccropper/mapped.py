@@ -0,0 +1,117 @@
+"""Memory-mapped cropping of uncompressed BMP and TIFF files.
+
+In an uncompressed BMP or TIFF every pixel row sits at a fixed file offset,
+which Pillow describes with 'raw' tile descriptors (offset, row stride and row
+order). Image.crop() would still read and unpack the whole file. Instead the
+file is memory-mapped and only the byte ranges of the crop columns in the
+crop rows are sliced out, so the OS only pages in the rows the crop covers
+and the copy work scales with the cropped area. BMP's bottom-up row order and
+4-byte row padding are both carried by the tile descriptor.
+"""
+from PIL import Image
+import mmap
+
+# Bits per pixel of the raw modes found in uncompressed TIFF and BMP files
+RAWMODE_BITS = {
+    'L': 8, 'P': 8, 'LA': 16, 'I;16': 16, 'I;16B': 16, 'I;16L': 16,
+    'RGB': 24, 'BGR': 24, 'RGBX': 32, 'RGBA': 32, 'BGRX': 32, 'BGRA': 32,
+    'CMYK': 32, 'I;32': 32, 'I;32B': 32, 'F;32F': 32, 'F;32BF': 32,
+}
+
+def _raw_args(args):
+    if isinstance(args, str):
+        return args, 0, 1
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    ystep = args[2] if len(args) > 2 else 1
+    return rawmode, stride, ystep
+
+def _raw_layout(img):
+    """(tiles, bits per pixel) if every tile is uncompressed and byte aligned, else None"""
+    tiles = list(img.tile)
+    if not tiles or any(tile[0] != 'raw' for tile in tiles):
+        return None
+    rawmodes = {_raw_args(tile[3])[0] for tile in tiles}
+    if len(rawmodes) != 1:
+        return None
+    bits = RAWMODE_BITS.get(rawmodes.pop())
+    if bits is None or bits % 8:
+        return None
+    return tiles, bits
+
+def _palette(img):
+    """(data, rawmode) of a P image's palette, read without decoding its pixels
+    (getpalette() would load the whole image first)"""
+    if img.mode != 'P' or img.palette is None:
+        return None
+    rawmode, data = img.palette.getdata()
+    return data, rawmode
+
+def can_map(img, crop_box):
+    """Whether mapped_crop() can serve this opened image and crop box"""
+    left, top, right, bottom = crop_box
+    # Images opened from file objects have an empty filename
+    filename = getattr(img, 'filename', None)
+    return (img.format in ('BMP', 'TIFF') and isinstance(filename, str) and filename != ''
+            and 0 <= left < right <= img.width and 0 <= top < bottom <= img.height
+            and _raw_layout(img) is not None)
+
+def _tile_region(mapped, tile, mode, bits, crop_box):
+    """(paste position, image) of the part of one raw tile inside the crop, or None"""
+    left, top, right, bottom = crop_box
+    _, (x0, y0, x1, y1), offset, args = tile
+    rawmode, stride, ystep = _raw_args(args)
+    ix0, ix1 = max(x0, left), min(x1, right)
+    iy0, iy1 = max(y0, top), min(y1, bottom)
+    if ix0 >= ix1 or iy0 >= iy1:
+        return None
+
+    bytes_per_pixel = bits // 8
+    stride = stride or (x1 - x0) * bytes_per_pixel
+    row_bytes = (ix1 - ix0) * bytes_per_pixel
+    # Rows in file order; bottom-up tiles (BMP) store their last row first
+    first_row = iy0 - y0 if ystep > 0 else y1 - iy1
+    start = offset + first_row * stride + (ix0 - x0) * bytes_per_pixel
+    rows = iy1 - iy0
+    if start + (rows - 1) * stride + row_bytes > len(mapped):
+        raise ValueError("image data ends before the crop box")
+
+    view = memoryview(mapped)
+    try:
+        data = b''.join(view[position:position + row_bytes]
+                        for position in range(start, start + rows * stride, stride))
+    finally:
+        view.release()
+
+    # Unpacked by the same raw decoder Pillow would use for the whole file
+    region = Image.frombuffer(mode, (ix1 - ix0, rows), data, 'raw', rawmode, 0, ystep)
+    return (ix0 - left, iy0 - top), region
+
+def mapped_crop(img, crop_box):
+    """Crop an opened, not yet loaded BMP or TIFF by slicing its memory-mapped
+    file. Returns the cropped image, or None if the file cannot be mapped
+    this way (compressed, bit-packed, not on disk, or the box leaves the image)
+    and the caller should use Image.crop() instead.
+    """
+    crop_box = tuple(crop_box)
+    if not can_map(img, crop_box):
+        return None
+    tiles, bits = _raw_layout(img)
+    left, top, right, bottom = crop_box
+
+    with open(img.filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        regions = [_tile_region(mapped, tile, img.mode, bits, crop_box) for tile in tiles]
+    regions = [region for region in regions if region is not None]
+
+    if len(regions) == 1 and regions[0][1].size == (right - left, bottom - top):
+        cropped = regions[0][1]
+    else:
+        # Strips or tiles of a TIFF are pasted side by side
+        cropped = Image.new(img.mode, (right - left, bottom - top))
+        for position, region in regions:
+            cropped.paste(region, position)
+
+    palette = _palette(img)
+    if palette is not None:
+        cropped.putpalette(*palette)
+    return cropped
@@ -0,0 +1,167 @@
+"""Header-only pre-flight checks run before a batch decodes any pixels."""
+from concurrent.futures import ThreadPoolExecutor
+from .engine import read_metadata
+from .tiled import open_image
+import io
+import os
+
+# Rough decode + crop + encode throughput per format, used to estimate run time
+# before any pixels are decoded
+MEGAPIXELS_PER_SECOND = {
+    'PNG': 25.0,
+    'JPEG': 60.0,
+    'BMP': 150.0,
+    'GIF': 40.0,
+}
+DEFAULT_MEGAPIXELS_PER_SECOND = 30.0
+
+# Bytes fetched from remote storage to read an image header; files whose
+# header is larger (big embedded profiles or thumbnails) are fetched whole
+HEADER_BYTES = 64 * 1024
+# Bytes at the end of a file searched for its end marker; cameras and tools
+# may append metadata trailers after the marker
+TAIL_BYTES = 4096
+GIF_TRAILER_SLACK = 16  # Padding allowed after GIF's one-byte trailer
+
+# End marker of every complete file of a format (for PNG the whole, empty IEND chunk)
+FORMAT_TRAILERS = {
+    'PNG': b'\x00\x00\x00\x00IEND\xaeB`\x82',
+    'JPEG': b'\xff\xd9',
+    'GIF': b'\x3b',
+}
+
+def get_cached_metadata(image_cache, input_path):
+    """Read dimensions, mode and format from the cache or the image header"""
+    if image_cache is not None:
+        return image_cache.get_metadata(input_path)
+    with open_image(input_path, pixel_limit=None) as img:
+        return read_metadata(img)
+
+def truncation_problem(image_format, file_size, head, tail):
+    """Return a reason if a file of file_size bytes, starting with head and
+    ending with tail, obviously ends early"""
+    if image_format == 'BMP':
+        # The file header records the total file size at offset 2
+        expected = int.from_bytes(head[2:6], 'little')
+        if file_size < expected:
+            return f"truncated: {file_size} of {expected} bytes"
+        return None
+    
+    trailer = FORMAT_TRAILERS.get(image_format)
+    if trailer is None:
+        return None
+    
+    # Decoders stop at the end marker, so data appended after it is harmless.
+    # GIF's one-byte trailer is too common a byte to look for further back.
+    if image_format == 'GIF':
+        found = trailer in tail.rstrip(b'\x00')[-len(trailer) - GIF_TRAILER_SLACK:]
+    else:
+        found = trailer in tail
+    
+    if not found:
+        return f"truncated: missing {image_format} end marker"
+    return None
+
+def check_truncated(input_path, image_format):
+    """Return a reason if the file obviously ends early, without decoding it"""
+    file_size = os.path.getsize(input_path)
+    with open(input_path, 'rb') as f:
+        head = f.read(6)
+        f.seek(max(0, file_size - TAIL_BYTES))
+        tail = f.read()
+    return truncation_problem(image_format, file_size, head, tail)
+
+def scan_stored(storage, name):
+    """(metadata, truncation problem) of an object in remote storage, fetching
+    only its header and its last bytes with ranged reads"""
+    file_size = storage.size(name)
+    head = storage.read_range(name, 0, min(file_size, HEADER_BYTES))
+    try:
+        with open_image(io.BytesIO(head), pixel_limit=None) as img:
+            metadata = read_metadata(img)
+    except Exception:
+        if file_size <= HEADER_BYTES:
+            raise
+        with open_image(io.BytesIO(storage.read(name)), pixel_limit=None) as img:
+            metadata = read_metadata(img)
+    tail = storage.read_range(name, max(0, file_size - TAIL_BYTES), file_size)
+    return metadata, truncation_problem(metadata['format'], file_size, head, tail)
+
+def preflight_scan(input_folder, image_files, crop_box, image_cache=None, workers=8,
+                   storage=None):
+    """Validate crop_box against every input using only file headers.
+    
+    With a storage backend (see storage.open_storage) the files are looked up
+    there instead of in input_folder; remote objects are checked with ranged
+    reads of their first and last bytes.
+    
+    Returns a dict with the files grouped by (width, height, mode, format),
+    the files the box does not fit, unreadable or truncated files, and
+    pixel totals with a rough run time estimate.
+    """
+    left, top, right, bottom = crop_box
+    
+    def scan(fname):
+        input_path = storage.local_path(fname) if storage else os.path.join(input_folder, fname)
+        try:
+            if input_path is None:
+                metadata, problem = scan_stored(storage, fname)
+            else:
+                metadata = get_cached_metadata(image_cache, input_path)
+                problem = check_truncated(input_path, metadata['format'])
+        except Exception as e:
+            return fname, None, str(e)
+        return fname, metadata, problem
+    
+    report = {
+        'groups': {},
+        'out_of_bounds': [],
+        'unreadable': [],
+        'total_pixels': 0,
+        'crop_pixels': 0,
+        'estimated_seconds': 0.0,
+    }
+    
+    # Header reads are I/O bound, so threads overlap the file system (or network) latency
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for fname, metadata, problem in executor.map(scan, image_files):
+            if metadata is None or problem:
+                report['unreadable'].append((fname, problem))
+                continue
+            
+            width, height = metadata['width'], metadata['height']
+            group = (width, height, metadata['mode'], metadata['format'])
+            report['groups'].setdefault(group, []).append(fname)
+            
+            if left < 0 or top < 0 or right > width or bottom > height:
+                report['out_of_bounds'].append(fname)
+                continue
+            
+            pixels = width * height
+            report['total_pixels'] += pixels
+            report['crop_pixels'] += (right - left) * (bottom - top)
+            rate = MEGAPIXELS_PER_SECOND.get(metadata['format'], DEFAULT_MEGAPIXELS_PER_SECOND)
+            report['estimated_seconds'] += pixels / (rate * 1e6)
+    
+    return report
+
+def print_preflight_report(report, crop_box):
+    """Print the pre-flight groups and problems to the console"""
+    print(f"Pre-flight check for crop box {crop_box}:")
+    for (width, height, mode, image_format), fnames in sorted(report['groups'].items(),
+                                                              key=lambda item: -len(item[1])):
+        print(f"  {len(fnames):6d} x {width}x{height} {mode} {image_format}")
+    
+    if report['out_of_bounds']:
+        print(f"  Crop box out of bounds: {len(report['out_of_bounds'])} images")
+        for fname in report['out_of_bounds'][:10]:
+            print(f"    {fname}")
+    
+    if report['unreadable']:
+        print(f"  Unreadable or truncated: {len(report['unreadable'])} images")
+        for fname, reason in report['unreadable'][:10]:
+            print(f"    {fname}: {reason}")
+    
+    print(f"  Total input: {report['total_pixels'] / 1e6:.1f} megapixels "
+          f"({report['crop_pixels'] / 1e6:.1f} after cropping)")
+    print(f"  Estimated time: {report['estimated_seconds']:.0f} seconds")
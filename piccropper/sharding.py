@@ -0,0 +1,157 @@
+"""Deterministic sharding of a batch across nodes, and result manifests."""
+import hashlib
+import json
+import os
+
+def shard_of(relative_path, shard_count):
+    """Stable shard number for a file, identical on every machine and Python run"""
+    # Hash the relative path with '/' separators so Windows and POSIX nodes agree
+    key = relative_path.replace(os.sep, '/').encode('utf-8', 'surrogateescape')
+    digest = hashlib.sha1(key).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def select_shard(image_files, shard):
+    """Files that belong to the given (index, count) shard"""
+    if shard is None:
+        return image_files
+    index, count = shard
+    return [fname for fname in image_files if shard_of(fname, count) == index]
+
+def default_manifest_path(output_folder, shard):
+    if shard is None:
+        return os.path.join(output_folder, 'manifest.json')
+    index, count = shard
+    return os.path.join(output_folder, f"manifest-shard-{index}-of-{count}.json")
+
+def build_manifest(input_folder, crop_box, shard, results):
+    """Manifest dict with the per-file results of one run (or shard)"""
+    return {
+        # Storage URLs (s3://...) are kept as they are
+        'input_folder': input_folder if '://' in input_folder else os.path.abspath(input_folder),
+        'crop_box': list(crop_box),
+        'shard': list(shard) if shard is not None else None,
+        'processed_count': sum(1 for r in results if r['status'] == 'ok'),
+        'error_count': sum(1 for r in results if r['status'] == 'error'),
+        'timeout_count': sum(1 for r in results if r['status'] == 'timeout'),
+        'skipped_count': sum(1 for r in results if r['status'] == 'skipped'),
+        # Files that needed more than one attempt, whatever their final status
+        'retried_count': sum(1 for r in results if r.get('attempts', 1) > 1),
+        'quarantined_count': sum(1 for r in results if r.get('quarantined')),
+        'files': results,
+    }
+
+def write_manifest(manifest_path, input_folder, crop_box, shard, results):
+    """Write the per-file results of one run (or shard) as JSON; returns manifest_path"""
+    manifest = build_manifest(input_folder, crop_box, shard, results)
+    # Write atomically so a merge never reads a half-written manifest
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest_path
+
+def _box_key(crop_box):
+    """Hashable form of a manifest's crop_box: one box, or a list of boxes for multi-box jobs"""
+    return tuple(tuple(box) if isinstance(box, list) else box for box in crop_box)
+
+def merge_manifests(manifest_paths, endpoint_url=None):
+    """Combine shard manifests into one summary and check the shards cover the folder.
+    
+    Reports shards that are missing, files that appear in more than one
+    manifest, and input files that no manifest accounts for. Manifests of
+    different input folders (e.g. the jobs of a job file) can be merged too;
+    files are told apart by folder, and by crop box index for multi-box jobs.
+    Duplicated and missing files are reported as paths in their input folder.
+    
+    Manifests and input folders may be storage URLs (s3://...), read with
+    endpoint_url as in storage.open_storage(). An input folder that cannot
+    be listed is reported as a problem, since coverage was not checked.
+    """
+    # Imported here: storage depends on jobs, which uses this module
+    from .storage import is_remote, open_storage
+    
+    def read_manifest(path):
+        if not is_remote(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        folder, _, name = path.rpartition('/')
+        storage = open_storage(folder, endpoint_url=endpoint_url)
+        try:
+            return json.loads(storage.read(name))
+        finally:
+            storage.close()
+    
+    def list_inputs(input_folder):
+        storage = open_storage(input_folder, endpoint_url=endpoint_url)
+        try:
+            return storage.list_images()
+        finally:
+            storage.close()
+    
+    def in_folder(folder, fname):
+        return f"{folder.rstrip('/')}/{fname}" if is_remote(folder) else os.path.join(folder, fname)
+    
+    manifests = [read_manifest(path) for path in manifest_paths]
+    
+    problems = []
+    shard_counts = {tuple(m['shard'])[1] for m in manifests if m['shard'] is not None}
+    if len(shard_counts) > 1:
+        problems.append(f"manifests disagree on the shard count: {sorted(shard_counts)}")
+    boxes = {}
+    for m in manifests:
+        boxes.setdefault(m['input_folder'], set()).add(_box_key(m['crop_box']))
+    if any(len(folder_boxes) > 1 for folder_boxes in boxes.values()):
+        problems.append("manifests were produced with different crop boxes")
+    
+    missing_shards = []
+    if len(shard_counts) == 1:
+        count = shard_counts.pop()
+        present = {m['shard'][0] for m in manifests if m['shard'] is not None}
+        missing_shards = sorted(set(range(count)) - present)
+        if missing_shards:
+            problems.append(f"missing shards: {missing_shards} of {count}")
+    
+    seen = {}
+    for path, manifest in zip(manifest_paths, manifests):
+        input_folder = manifest['input_folder']
+        for result in manifest['files']:
+            key = (input_folder, result['file'], result.get('box'))
+            seen.setdefault(key, []).append((path, dict(result, input_folder=input_folder)))
+    duplicated = sorted(in_folder(folder, fname)
+                        for (folder, fname, _), entries in seen.items() if len(entries) > 1)
+    if duplicated:
+        problems.append(f"{len(duplicated)} files appear in more than one manifest")
+    
+    missing_files = []
+    for input_folder in sorted(boxes):
+        if not is_remote(input_folder) and not os.path.isdir(input_folder):
+            problems.append(f"input folder {input_folder} not found; its coverage was not checked")
+            continue
+        try:
+            image_files = list_inputs(input_folder)
+        except Exception as e:
+            problems.append(f"could not list {input_folder} ({e}); its coverage was not checked")
+            continue
+        covered = {fname for folder, fname, _ in seen if folder == input_folder}
+        missing_files.extend(in_folder(input_folder, fname)
+                             for fname in sorted(set(image_files) - covered))
+    if missing_files:
+        problems.append(f"{len(missing_files)} input files are not in any manifest")
+    
+    # For duplicated files the last manifest wins, so totals count each file once
+    final = {key: entries[-1][1] for key, entries in seen.items()}
+    return {
+        'manifests': list(manifest_paths),
+        'processed_count': sum(1 for r in final.values() if r['status'] == 'ok'),
+        'error_count': sum(1 for r in final.values() if r['status'] == 'error'),
+        'timeout_count': sum(1 for r in final.values() if r['status'] == 'timeout'),
+        'skipped_count': sum(1 for r in final.values() if r['status'] == 'skipped'),
+        'retried_count': sum(1 for r in final.values() if r.get('attempts', 1) > 1),
+        'quarantined_count': sum(1 for r in final.values() if r.get('quarantined')),
+        'total_seconds': sum(r.get('seconds', 0.0) for r in final.values()),
+        'missing_shards': missing_shards,
+        'duplicated_files': duplicated,
+        'missing_files': missing_files,
+        'problems': problems,
+        'files': [final[key] for key in sorted(final, key=lambda k: (k[0], k[1], k[2] or 0))],
+    }
@@ -0,0 +1,267 @@
+"""Storage backends for inputs and outputs: local folders and S3-compatible buckets.
+
+Both backends offer the same small interface, so the scanner and the batch
+loop do not care where images live:
+
+    list_images()              names of the images directly inside the location
+    exists(name)               whether the object exists
+    size(name)                 object size in bytes
+    read(name)                 the whole object
+    read_range(name, start, end)  bytes start..end-1, e.g. just a header
+    write(name, data)          store an object (atomically where possible)
+    local_path(name)           a filesystem path, or None for remote storage
+    url(name)                  a printable location
+
+S3Storage keeps a pool of connections and splits large objects into parts
+that are fetched with concurrent ranged GETs and stored with concurrent
+multipart uploads. crop_between() overlaps those transfers with cropping:
+downloads run ahead of the crop workers and each crop is uploaded while the
+next ones are cropped. boto3 is only imported when an s3:// location is used;
+any S3-compatible server (MinIO, Ceph, ...) works through endpoint_url or the
+AWS_ENDPOINT_URL environment variable.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .engine import IMAGE_EXTENSIONS, crop_stream, list_image_files, run_bounded
+from .jobs import job_output_name
+import io
+import os
+
+PART_SIZE = 8 * 1024 * 1024  # Bytes per ranged GET and per multipart upload part
+DEFAULT_CONNECTIONS = 16
+DEFAULT_TRANSFER_WORKERS = 8
+
+def _import_boto3():
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError:
+        raise ImportError("boto3 is required for s3:// locations: pip install boto3") from None
+    return boto3, Config
+
+def is_remote(location):
+    """Whether a location is a URL rather than a local folder"""
+    return '://' in str(location)
+
+class LocalStorage:
+    """A folder on the local filesystem"""
+    def __init__(self, root):
+        self.root = os.fspath(root)
+
+    def list_images(self):
+        return sorted(list_image_files(self.root))
+
+    def local_path(self, name):
+        return os.path.join(self.root, name)
+
+    def url(self, name=''):
+        return self.local_path(name)
+
+    def exists(self, name):
+        return os.path.isfile(self.local_path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.local_path(name))
+
+    def read(self, name):
+        with open(self.local_path(name), 'rb') as f:
+            return f.read()
+
+    def read_range(self, name, start, end):
+        with open(self.local_path(name), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def write(self, name, data):
+        path = self.local_path(name)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        pass
+
+class S3Storage:
+    """Objects under a prefix of an S3 (or S3-compatible) bucket"""
+    def __init__(self, bucket, prefix='', endpoint_url=None, max_connections=DEFAULT_CONNECTIONS,
+                 part_size=PART_SIZE, client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.part_size = part_size
+        if client is None:
+            boto3, Config = _import_boto3()
+            # One pool of keep-alive connections shared by all transfer threads
+            client = boto3.client('s3', endpoint_url=endpoint_url, config=Config(
+                max_pool_connections=max_connections, retries={'mode': 'adaptive', 'max_attempts': 5}))
+        self.client = client
+        self._parts = ThreadPoolExecutor(max_workers=max_connections)
+        self._sizes = {}
+
+    def key(self, name):
+        return self.prefix + name
+
+    def local_path(self, name):
+        return None
+
+    def url(self, name=''):
+        return f"s3://{self.bucket}/{self.key(name)}"
+
+    def list_images(self):
+        names = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, Delimiter='/'):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(self.prefix):]
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    self._sizes[name] = item['Size']
+                    names.append(name)
+        return sorted(names)
+
+    def exists(self, name):
+        try:
+            self._sizes[name] = self.client.head_object(Bucket=self.bucket,
+                                                        Key=self.key(name))['ContentLength']
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        if name not in self._sizes:
+            self._sizes[name] = self.client.head_object(Bucket=self.bucket,
+                                                        Key=self.key(name))['ContentLength']
+        return self._sizes[name]
+
+    def read_range(self, name, start, end):
+        if end <= start:
+            return b''
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(name),
+                                          Range=f"bytes={start}-{end - 1}")
+        return response['Body'].read()
+
+    def read(self, name):
+        """Fetch an object; large ones as concurrent ranged GETs of part_size bytes"""
+        size = self.size(name)
+        if size <= self.part_size:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body'].read()
+        parts = [self._parts.submit(self.read_range, name, start, min(size, start + self.part_size))
+                 for start in range(0, size, self.part_size)]
+        return b''.join(part.result() for part in parts)
+
+    def write(self, name, data):
+        """Store an object; large ones as a multipart upload with concurrent parts"""
+        key = self.key(name)
+        if len(data) <= self.part_size:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+        view = memoryview(data)
+
+        def upload_part(number, start):
+            response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                               PartNumber=number,
+                                               Body=bytes(view[start:start + self.part_size]))
+            return {'PartNumber': number, 'ETag': response['ETag']}
+
+        try:
+            parts = [self._parts.submit(upload_part, number, start)
+                     for number, start in enumerate(range(0, len(data), self.part_size), 1)]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': [part.result() for part in parts]})
+        except BaseException:
+            # Do not leave the uploaded parts behind (they are billed until aborted)
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def close(self):
+        self._parts.shutdown(wait=True)
+
+def open_storage(location, **options):
+    """Storage for "s3://bucket/prefix" or a local folder path.
+
+    options are passed to S3Storage (endpoint_url, max_connections,
+    part_size) and ignored for local folders.
+    """
+    location = os.fspath(location)
+    if location.startswith('s3://'):
+        bucket, _, prefix = location[len('s3://'):].partition('/')
+        return S3Storage(bucket, prefix, **options)
+    if is_remote(location):
+        raise ValueError(f"unsupported storage location {location!r}; use a folder or s3://")
+    return LocalStorage(location)
+
+class _Download(io.BytesIO):
+    """A downloaded object, named so crop results can be traced back to it"""
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+class _FailedDownload:
+    """Stands in for an object that could not be read; reading raises the error"""
+    def __init__(self, name, error):
+        self.name = name
+        self.error = error
+
+    def read(self):
+        raise self.error
+
+def _prefetched(storage, names, transfers, prefetch):
+    """Yield crop sources for names, downloading up to `prefetch` of them ahead"""
+    jobs = ((name, storage.read, (name,)) for name in names)
+    for name, future in run_bounded(transfers, jobs, prefetch):
+        try:
+            yield _Download(name, future.result())
+        except Exception as e:
+            yield _FailedDownload(name, e)
+
+def crop_between(input_storage, output_storage, names, crop_box, output_format=None,
+                 transfer_workers=DEFAULT_TRANSFER_WORKERS, prefetch=None, **options):
+    """Crop the named images of input_storage into output_storage and yield a
+    crop_stream() result per image as soon as its output is stored.
+
+    Up to `prefetch` downloads (default: twice transfer_workers) run ahead of
+    the crop workers, and uploads run on the same transfer threads while the
+    next images are cropped. Inputs with a local path are read in place.
+    options are passed to crop_stream(). In the results 'source' is the
+    input name, 'output' the output name and 'bytes' the size of the output.
+    """
+    prefetch = prefetch or 2 * transfer_workers
+
+    def finished(result, upload):
+        try:
+            upload.result()
+        except Exception as e:
+            return dict(result, status='error', error=f"upload failed: {e}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=transfer_workers) as transfers:
+        local = [input_storage.local_path(name) for name in names]
+        if all(path is not None for path in local):
+            sources = local
+        else:
+            sources = _prefetched(input_storage, names, transfers, prefetch)
+
+        uploads = {}
+        for result in crop_stream(sources, crop_box, None, output_format, **options):
+            source = result['source']
+            name = os.path.basename(source) if isinstance(source, str) else source.name
+            result = dict(result, source=name, output=job_output_name(name, 0, 1, output_format))
+            if result['status'] != 'ok':
+                yield result
+                continue
+
+            data = result.pop('data')
+            uploads[transfers.submit(output_storage.write, result['output'], data)] = \
+                dict(result, data=None, bytes=len(data))
+            # Hold at most `prefetch` encoded crops waiting for upload
+            while len(uploads) >= prefetch:
+                done, _ = wait(uploads, return_when=FIRST_COMPLETED)
+                for upload in done:
+                    yield finished(uploads.pop(upload), upload)
+
+        for upload in list(uploads):
+            yield finished(uploads.pop(upload), upload)
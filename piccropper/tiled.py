@@ -0,0 +1,286 @@
+"""Out-of-core cropping for images too large to decode in one piece.
+
+Pillow decodes a whole image into memory, and Image.open refuses very large
+ones through the global MAX_IMAGE_PIXELS decompression-bomb guard. open_image()
+applies an explicit per-call pixel limit instead (the global guard is only
+lifted while Image.open reads the header), and the crop region of large
+inputs is read in horizontal bands:
+
+- uncompressed TIFF (striped or tiled) and BMP: each band is sliced out of
+  the memory-mapped file (see mapped.py), so only the crop region is read;
+- non-interlaced 8-bit PNG: the IDAT stream is inflated incrementally and each
+  band is unfiltered by Pillow's PNG decoder, seeded with the last row of the
+  previous band. Rows below the crop are never inflated.
+
+When the output is a PNG of a mode PNG can store as is (L, LA, RGB, RGBA,
+P with its palette and transparency, 16-bit I;16), bands go straight to a
+streaming PNG writer, so memory stays bounded by a few bands regardless of
+image and crop size. Other outputs are assembled at crop size first.
+"""
+from PIL import Image
+from contextlib import contextmanager
+from .encoders import _ancillary_chunks, save_image
+from .mapped import _palette, _raw_layout, can_map, mapped_crop
+import io
+import os
+import struct
+import threading
+import zlib
+
+DEFAULT_PIXEL_LIMIT = 2 ** 32  # Largest input accepted at all
+TILED_PIXEL_THRESHOLD = 64 * 1024 * 1024  # Inputs above this are read in bands
+IN_MEMORY_PIXEL_LIMIT = 2 * 89_478_485  # Pillow's own hard limit for full decodes
+BAND_BYTES = 32 * 1024 * 1024  # Target size of one decoded band
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_BYTES_PER_PIXEL = {'L': 1, 'P': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+# Modes streamed to PNG unchanged: (color type, bit depth, bytes per pixel,
+# raw mode of the samples as PNG stores them)
+PNG_STREAM_LAYOUTS = {
+    'L': (0, 8, 1, 'L'), 'RGB': (2, 8, 3, 'RGB'), 'P': (3, 8, 1, 'P'),
+    'LA': (4, 8, 2, 'LA'), 'RGBA': (6, 8, 4, 'RGBA'), 'I;16': (0, 16, 2, 'I;16B'),
+}
+
+_guard_lock = threading.Lock()
+_guard_users = 0
+_saved_max_pixels = None
+
+@contextmanager
+def _bomb_guard_lifted():
+    """Switch off Pillow's global decompression-bomb guard for the duration.
+
+    Nested and concurrent users share one switch, and the last one out
+    restores the original value.
+    """
+    global _guard_users, _saved_max_pixels
+    with _guard_lock:
+        if _guard_users == 0:
+            _saved_max_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _guard_users += 1
+    try:
+        yield
+    finally:
+        with _guard_lock:
+            _guard_users -= 1
+            if _guard_users == 0:
+                Image.MAX_IMAGE_PIXELS = _saved_max_pixels
+
+def open_image(source, pixel_limit=DEFAULT_PIXEL_LIMIT):
+    """Image.open with an explicit pixel limit instead of the global bomb guard.
+
+    pixel_limit None accepts any size, for callers that only read the header.
+    """
+    # The global guard would reject large inputs before the limit below
+    # applies; it is only lifted while the header is read
+    with _bomb_guard_lifted():
+        img = Image.open(source)
+    if pixel_limit is not None and img.width * img.height > pixel_limit:
+        img.close()
+        raise Image.DecompressionBombError(
+            f"image has {img.width * img.height} pixels, more than the limit of {pixel_limit}")
+    return img
+
+def _band_rows(width, bytes_per_pixel):
+    return max(1, BAND_BYTES // max(1, width * bytes_per_pixel))
+
+def iter_raw_bands(path, img, crop_box):
+    """Yield (top row within the crop, band image) for an uncompressed TIFF or BMP"""
+    _, bits = _raw_layout(img)
+    left, top, right, bottom = crop_box
+    band_rows = _band_rows(right - left, bits // 8)
+
+    for band_top in range(top, bottom, band_rows):
+        band_bottom = min(bottom, band_top + band_rows)
+        yield band_top - top, mapped_crop(img, (left, band_top, right, band_bottom))
+
+def _png_chunks(f):
+    if f.read(8) != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("PNG file ends before IEND")
+        length, chunk_type = struct.unpack('>I4s', header)
+        data = f.read(length)
+        f.read(4)  # CRC
+        yield chunk_type, data
+        if chunk_type == b'IEND':
+            return
+
+def iter_png_bands(path, img, crop_box):
+    """Yield (top row within the crop, band image) for a non-interlaced 8-bit PNG"""
+    left, top, right, bottom = crop_box
+    width = img.width
+    rawmode = img.tile[0][3]
+    row_bytes = width * PNG_BYTES_PER_PIXEL[rawmode]
+    band_rows = _band_rows(width, PNG_BYTES_PER_PIXEL[rawmode])
+    palette = _palette(img)
+
+    band_bytes = band_rows * (row_bytes + 1)
+    inflater = zlib.decompressobj()
+    pending = bytearray()
+    previous = bytes(row_bytes)  # The decoder treats the row above the image as zeros
+    row = 0
+
+    def take_band(count):
+        """Unfilter the next count rows; return the part inside the crop, if any"""
+        nonlocal previous, row
+        size = count * (row_bytes + 1)
+        # Prefix the band with the already unfiltered previous row (filter type 0),
+        # so Pillow's decoder unfilters the band's first row against it
+        data = b'\x00' + previous + bytes(pending[:size])
+        del pending[:size]
+        band = Image.frombytes(img.mode, (width, count + 1), zlib.compress(data, 0), 'zip', rawmode)
+        previous = band.crop((0, count, width, count + 1)).tobytes()
+
+        first, row = row, row + count
+        if first + count <= top:
+            return None
+        skip = max(0, top - first)
+        region = band.crop((left, 1 + skip, right, 1 + count))
+        if palette is not None:
+            region.putpalette(*palette)
+        return first + skip - top, region
+
+    with open(path, 'rb') as f:
+        for chunk_type, data in _png_chunks(f):
+            if chunk_type != b'IDAT':
+                continue
+
+            # Inflate at most one band at a time, so a small but highly
+            # compressed chunk cannot expand into a huge buffer
+            while data and row < bottom:
+                pending += inflater.decompress(data, band_bytes)
+                data = inflater.unconsumed_tail
+                while row < bottom and len(pending) >= min(band_rows, bottom - row) * (row_bytes + 1):
+                    result = take_band(min(band_rows, bottom - row))
+                    if result is not None:
+                        yield result
+
+            if row >= bottom:
+                return
+
+        pending += inflater.flush()
+        while row < bottom:
+            count = min(band_rows, bottom - row, len(pending) // (row_bytes + 1))
+            if count == 0:
+                raise ValueError("PNG image data ends before the crop box")
+            result = take_band(count)
+            if result is not None:
+                yield result
+
+def iter_bands(path, img, crop_box):
+    """Band iterator for the crop region, or None if this input cannot be read in bands"""
+    left, top, right, bottom = crop_box
+    if left < 0 or top < 0 or right > img.width or bottom > img.height:
+        return None
+
+    if can_map(img, crop_box):
+        return iter_raw_bands(path, img, crop_box)
+
+    if (img.format == 'PNG' and len(img.tile) == 1 and img.tile[0][0] == 'zip'
+            and img.tile[0][3] in PNG_BYTES_PER_PIXEL and not img.info.get('interlace')):
+        return iter_png_bands(path, img, crop_box)
+
+    return None
+
+class PNGStreamWriter:
+    """Write a PNG one band of rows at a time, without holding the whole image.
+
+    chunks are extra chunks (PLTE, tRNS, ...) written between IHDR and the
+    image data.
+    """
+    def __init__(self, f, width, height, mode, compress_level=6, chunks=()):
+        if mode not in PNG_STREAM_LAYOUTS:
+            raise ValueError(f"cannot stream {mode} images to PNG")
+        self.f = f
+        self.width = width
+        self.mode = mode
+        color_type, bit_depth, self.bytes_per_pixel, self.rawmode = PNG_STREAM_LAYOUTS[mode]
+        self.compressor = zlib.compressobj(compress_level)
+        f.write(PNG_SIGNATURE)
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth,
+                                              color_type, 0, 0, 0))
+        for chunk in chunks:
+            f.write(chunk)
+
+    def write_chunk(self, chunk_type, data):
+        self.f.write(struct.pack('>I', len(data)))
+        self.f.write(chunk_type)
+        self.f.write(data)
+        self.f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def write_band(self, band):
+        """Append the rows of a band image (filter type 0 on every row)"""
+        raw = band.tobytes('raw', self.rawmode)
+        row_bytes = self.width * self.bytes_per_pixel
+        rows = b''.join(b'\x00' + raw[start:start + row_bytes]
+                        for start in range(0, len(raw), row_bytes))
+        compressed = self.compressor.compress(rows)
+        if compressed:
+            self.write_chunk(b'IDAT', compressed)
+
+    def close(self):
+        self.write_chunk(b'IDAT', self.compressor.flush())
+        self.write_chunk(b'IEND', b'')
+
+def _stream_chunks(img):
+    """PLTE, tRNS, pHYs and iCCP chunks for a streamed crop of img, read
+    without decoding img's pixels"""
+    # A 16-bit grayscale tRNS is written like an 8-bit one, as one 2-byte sample
+    header = Image.new(img.mode if img.mode != 'I;16' else 'L', (1, 1))
+    header.info = {key: img.info[key] for key in ('transparency', 'dpi', 'icc_profile')
+                   if key in img.info}
+    palette = _palette(img)
+    if palette is not None:
+        header.putpalette(*palette)
+    return _ancillary_chunks(header)
+
+def tiled_crop(path, img, crop_box, output_path=None, output_format=None, output_size=None,
+               png_encoder=None, save_options=None):
+    """Crop a large image band by band. Returns the encoded bytes (None when
+    written to output_path), or NotImplemented if the input cannot be read in
+    bands and the caller should fall back to a full decode.
+    """
+    bands = iter_bands(path, img, crop_box)
+    if bands is None:
+        return NotImplemented
+
+    left, top, right, bottom = crop_box
+    crop_size = (right - left, bottom - top)
+    if output_format is None and output_path is not None:
+        output_format = Image.registered_extensions().get(os.path.splitext(output_path)[1].lower())
+    output_format = output_format or img.format
+
+    if output_size is None and output_format == 'PNG' and img.mode in PNG_STREAM_LAYOUTS:
+        f = open(output_path, 'wb') if output_path is not None else io.BytesIO()
+        try:
+            writer = PNGStreamWriter(f, crop_size[0], crop_size[1], img.mode,
+                                     (save_options or {}).get('compress_level', 6),
+                                     _stream_chunks(img))
+            for _, band in bands:
+                writer.write_band(band)
+            writer.close()
+            return None if output_path is not None else f.getvalue()
+        finally:
+            f.close()
+
+    # Other modes are assembled at crop size and saved like a full decode would be
+    cropped = Image.new(img.mode, crop_size)
+    palette = _palette(img)
+    if palette is not None:
+        cropped.putpalette(*palette)
+    if 'transparency' in img.info:
+        cropped.info['transparency'] = img.info['transparency']
+    for y, band in bands:
+        cropped.paste(band, (0, y))
+    if output_size is not None:
+        cropped = cropped.resize(output_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if output_path is not None:
+        save_image(cropped, output_path, output_format, png_encoder, save_options)
+        return None
+    buffer = io.BytesIO()
+    save_image(cropped, buffer, output_format, png_encoder, save_options)
+    return buffer.getvalue()
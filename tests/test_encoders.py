@@ -0,0 +1,74 @@
+"""Round-trip tests for the parallel PNG writer: whatever it writes must decode
+to exactly the pixels it was given."""
+from PIL import Image
+import io
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from piccropper import encoders
+from piccropper.encoders import PNG_LAYOUTS, save_image, save_parallel_png
+
+def noisy(mode, size, seed=0):
+    """An image of the mode with smooth areas, edges and noise, so every filter type wins somewhere"""
+    rng = numpy.random.default_rng(seed)
+    width, height = size
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    y, x = numpy.mgrid[0:height, 0:width]
+    values = (x * 3 + y * 5)[..., None] + rng.integers(0, 40, (height, width, bands))
+    values[: height // 3] = rng.integers(0, 256, (height // 3, width, bands))
+    values = (values % 256).astype(numpy.uint8)
+    if mode == 'P':
+        img = Image.fromarray(values[..., 0], 'L').convert('P')
+        img.putpalette(rng.integers(0, 256, 768, numpy.uint8).tobytes())
+        return img
+    return Image.fromarray(values.squeeze(-1) if bands == 1 else values, mode)
+
+def round_trip(img, **options):
+    buffer = io.BytesIO()
+    save_parallel_png(img, buffer, **options)
+    buffer.seek(0)
+    decoded = Image.open(buffer)
+    decoded.load()
+    return decoded
+
+@pytest.mark.parametrize('mode', sorted(PNG_LAYOUTS))
+@pytest.mark.parametrize('compress_level', [0, 1, 6, 9])
+def test_modes_and_levels(mode, compress_level):
+    img = noisy(mode, (123, 77))
+    decoded = round_trip(img, threads=2, compress_level=compress_level)
+    assert decoded.mode == mode
+    assert decoded.tobytes() == img.tobytes()
+    if mode == 'P':
+        assert decoded.getpalette() == img.getpalette()
+
+@pytest.mark.parametrize('chunk_bytes', [1, 100, 1000, 4096, 10 ** 9])
+@pytest.mark.parametrize('size', [(1, 1), (1, 50), (50, 1), (97, 61)])
+def test_chunk_boundaries(monkeypatch, chunk_bytes, size):
+    # Chunks of one row up to one chunk for the whole image, with heights that
+    # do not divide evenly, and deflate histories longer than a chunk
+    monkeypatch.setattr(encoders, 'CHUNK_BYTES', chunk_bytes)
+    monkeypatch.setattr(encoders, 'WINDOW_BYTES', 300)
+    img = noisy('RGB', size, seed=chunk_bytes)
+    assert round_trip(img, threads=3).tobytes() == img.tobytes()
+
+def test_ancillary_chunks():
+    img = noisy('P', (40, 30))
+    img.info['transparency'] = bytes(range(0, 256, 2))
+    img.info['dpi'] = (300, 300)
+    decoded = round_trip(img)
+    assert decoded.info['transparency'] == img.info['transparency']
+    assert tuple(round(v) for v in decoded.info['dpi']) == (300, 300)
+
+    rgb = noisy('RGB', (40, 30))
+    rgb.info['transparency'] = (1, 2, 3)
+    assert round_trip(rgb).info['transparency'] == (1, 2, 3)
+
+def test_save_image_uses_parallel_writer_for_large_crops(monkeypatch):
+    calls = []
+    monkeypatch.setattr(encoders, 'save_parallel_png',
+                        lambda img, fp, **kwargs: calls.append(img.size))
+    save_image(noisy('RGB', (700, 600)), io.BytesIO(), 'PNG', 'parallel')
+    save_image(noisy('RGB', (10, 10)), io.BytesIO(), 'PNG', 'parallel')
+    save_image(noisy('RGB', (700, 600)), io.BytesIO(), 'PNG', 'pillow')
+    assert calls == [(700, 600)]
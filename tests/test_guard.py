@@ -0,0 +1,122 @@
+"""Tests for TimeoutPool, retries and quarantine.
+
+Task functions live at module level so spawned workers can import them.
+"""
+from piccropper.guard import (CropTimeoutError, TimeoutPool, WorkerCrashedError, is_transient,
+                              quarantine_files, with_retries)
+import errno
+import json
+import os
+import signal
+import time
+import pytest
+
+RESULT_WAIT = 60  # Seconds to wait for any future; a hang fails the test instead of the run
+
+def double(x):
+    return 2 * x
+
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+def crash(code):
+    os._exit(code)
+
+def crash_after(seconds):
+    time.sleep(seconds)
+    os._exit(1)
+
+def pid():
+    return os.getpid()
+
+class TwoArgumentError(Exception):
+    def __init__(self, a, b):
+        super().__init__(f"{a}/{b}")
+
+def raise_two_argument_error():
+    raise TwoArgumentError(1, 2)
+
+def test_results_and_errors():
+    with TimeoutPool(2, timeout=30) as pool:
+        assert [f.result(RESULT_WAIT) for f in [pool.submit(double, i) for i in range(5)]] == \
+            [0, 2, 4, 6, 8]
+        with pytest.raises(ZeroDivisionError):
+            pool.submit(divmod, 1, 0).result(RESULT_WAIT)
+        # Exceptions that cannot be unpickled arrive as RuntimeError
+        with pytest.raises(RuntimeError, match='TwoArgumentError'):
+            pool.submit(raise_two_argument_error).result(RESULT_WAIT)
+        assert pool.submit(double, 21).result(RESULT_WAIT) == 42
+
+def test_timeout_replaces_worker():
+    with TimeoutPool(1, timeout=0.5) as pool:
+        with pytest.raises(CropTimeoutError):
+            pool.submit(nap, 30).result(RESULT_WAIT)
+        assert pool.submit(double, 2).result(RESULT_WAIT) == 4
+        assert pool.recycled == 1
+
+def test_startup_does_not_count_against_timeout():
+    # Each worker spawns fresh, which alone can take longer than the timeout
+    with TimeoutPool(2, timeout=0.5) as pool:
+        futures = [pool.submit(nap, 0.05) for _ in range(4)]
+        assert [f.result(RESULT_WAIT) for f in futures] == [0.05] * 4
+        with pytest.raises(CropTimeoutError):
+            pool.submit(nap, 30).result(RESULT_WAIT)
+        # The replacement worker starts from scratch too
+        assert pool.submit(nap, 0.05).result(RESULT_WAIT) == 0.05
+
+def test_crash_replaces_worker():
+    with TimeoutPool(1, timeout=30) as pool:
+        with pytest.raises(WorkerCrashedError):
+            pool.submit(crash, 3).result(RESULT_WAIT)
+        assert pool.submit(double, 3).result(RESULT_WAIT) == 6
+
+def test_crash_at_deadline():
+    # A worker that dies just as its deadline passes must be retired once, not twice
+    with TimeoutPool(1, timeout=0.2) as pool:
+        for _ in range(5):
+            with pytest.raises((WorkerCrashedError, CropTimeoutError)):
+                pool.submit(crash_after, 0.199).result(RESULT_WAIT)
+            assert pool.submit(double, 4).result(RESULT_WAIT) == 8
+
+def test_idle_worker_death():
+    with TimeoutPool(1, timeout=30) as pool:
+        first = pool.submit(pid).result(RESULT_WAIT)
+        # Killed from outside while idle, e.g. by the OOM killer
+        os.kill(first, signal.SIGKILL)
+        pool._workers[0]['process'].join(RESULT_WAIT)
+        futures = [pool.submit(double, i) for i in range(3)]
+        assert [f.result(RESULT_WAIT) for f in futures] == [0, 2, 4]
+        assert pool.submit(pid).result(RESULT_WAIT) != first
+
+def test_with_retries():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError(errno.EIO, "I/O error")
+        return 'done'
+    assert with_retries(flaky, (), retries=2, delay=0) == ('done', 3)
+
+    def broken():
+        raise ValueError("not an image")
+    with pytest.raises(ValueError) as excinfo:
+        with_retries(broken, (), retries=2, delay=0)
+    assert excinfo.value.attempts == 1
+    assert is_transient(OSError(errno.ETIMEDOUT, "timed out"))
+    assert not is_transient(OSError(errno.ENOENT, "missing"))
+
+def test_quarantine_files(tmp_path):
+    (tmp_path / 'in').mkdir()
+    for name in ('bad.png', 'good.png'):
+        (tmp_path / 'in' / name).write_bytes(b'x')
+    entries = [{'file': 'bad.png', 'status': 'error', 'error': 'truncated'},
+               {'file': 'good.png', 'status': 'ok'}]
+    quarantine = str(tmp_path / 'q')
+    assert quarantine_files(str(tmp_path / 'in'), entries, quarantine) == 1
+    assert sorted(os.listdir(tmp_path / 'in')) == ['good.png']
+    assert entries[0]['quarantined'] == os.path.join(quarantine, 'bad.png')
+    with open(os.path.join(quarantine, 'quarantine.json')) as f:
+        assert [r['reason'] for r in json.load(f)] == ['truncated']
+    assert sorted(os.listdir(quarantine)) == ['bad.png', 'quarantine.json']
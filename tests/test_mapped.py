@@ -0,0 +1,161 @@
+"""mapped_crop() reads the crop straight from the file's bytes, so it must give
+exactly the pixels Image.crop gives for every row order, row padding and
+strip or tile layout."""
+from PIL import Image
+import io
+import random
+import struct
+import pytest
+
+from piccropper.engine import crop_one
+from piccropper.mapped import mapped_crop
+
+SIZE = (61, 47)
+# Boxes touching each edge, a single pixel, one full row and the whole image
+CROP_BOXES = [(0, 0, 61, 47), (0, 0, 20, 9), (5, 13, 56, 30), (40, 38, 61, 47),
+              (30, 23, 31, 24), (0, 46, 61, 47)]
+
+def noisy(mode, size, seed=0):
+    """An image of the mode filled with random bytes"""
+    img = Image.new(mode, size)
+    data = random.Random(seed).randbytes(len(img.tobytes()))
+    img.frombytes(data)
+    if mode == 'P':
+        img.putpalette(random.Random(seed + 1).randbytes(768))
+    return img
+
+def top_down_bmp(data):
+    """Rewrite a bottom-up BMP as top-down: negative height, first row first"""
+    offset, = struct.unpack_from('<I', data, 10)
+    width, height, _, bits = struct.unpack_from('<iiHH', data, 18)
+    stride = (width * bits + 31) // 32 * 4
+    rows = [data[offset + row * stride:offset + (row + 1) * stride] for row in range(height)]
+    header = bytearray(data[:offset])
+    struct.pack_into('<i', header, 22, -height)
+    return bytes(header) + b''.join(reversed(rows))
+
+def tiled_tiff(img, tile_size):
+    """An uncompressed tiled TIFF of an L or RGB image (Pillow only writes strips)"""
+    width, height = img.size
+    samples = len(img.getbands())
+    # crop() pads the tiles that stick out of the image with zeros
+    tiles = [img.crop((x, y, x + tile_size, y + tile_size)).tobytes()
+             for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    count = len(tiles)
+    bits_at = 8 + 2 + 10 * 12 + 4
+    offsets_at = bits_at + 2 * samples
+    counts_at = offsets_at + 4 * count
+    data_at = counts_at + 4 * count
+
+    def short(tag, value):
+        return struct.pack('<HHIHH', tag, 3, 1, value, 0)
+
+    def stored(tag, value_type, count, offset):
+        # Values that do not fit in the 4-byte entry field are stored at offset
+        return struct.pack('<HHII', tag, value_type, count, offset)
+
+    ifd = [short(256, width), short(257, height),
+           short(258, 8) if samples == 1 else stored(258, 3, samples, bits_at),
+           short(259, 1), short(262, 2 if samples == 3 else 1), short(277, samples),
+           short(322, tile_size), short(323, tile_size),
+           stored(324, 4, count, offsets_at), stored(325, 4, count, counts_at)]
+    return (b'II*\x00' + struct.pack('<IH', 8, len(ifd)) + b''.join(ifd) + struct.pack('<I', 0)
+            + struct.pack(f'<{samples}H', *[8] * samples)
+            + struct.pack(f'<{count}I', *[data_at + i * len(tiles[0]) for i in range(count)])
+            + struct.pack(f'<{count}I', *[len(tile) for tile in tiles]) + b''.join(tiles))
+
+def assert_same_as_crop(path, crop_box):
+    with Image.open(path) as img:
+        cropped = mapped_crop(img, crop_box)
+    with Image.open(path) as img:
+        expected = img.crop(crop_box)
+    assert cropped is not None
+    assert cropped.mode == expected.mode
+    assert cropped.size == expected.size
+    assert cropped.tobytes() == expected.tobytes()
+    if expected.mode == 'P':
+        assert cropped.getpalette() == expected.getpalette()
+
+@pytest.mark.parametrize('mode', ['L', 'P', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('order', ['bottom-up', 'top-down'])
+@pytest.mark.parametrize('crop_box', CROP_BOXES)
+def test_bmp(tmp_path, mode, order, crop_box):
+    path = tmp_path / 'in.bmp'
+    buffer = io.BytesIO()
+    noisy(mode, SIZE).save(buffer, format='BMP')
+    data = buffer.getvalue()
+    path.write_bytes(data if order == 'bottom-up' else top_down_bmp(data))
+
+    with Image.open(path) as img:
+        ystep = img.tile[0][3][2]
+    assert (ystep < 0) == (order == 'bottom-up')
+    assert_same_as_crop(path, crop_box)
+
+@pytest.mark.parametrize('width', [1, 2, 3, 4, 5])
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_bmp_row_padding(tmp_path, width, mode):
+    # Rows are padded to 4 bytes, so each width leaves a different gap
+    path = tmp_path / 'in.bmp'
+    noisy(mode, (width, 9), seed=width).save(path)
+    for crop_box in ((0, 0, width, 9), (width - 1, 2, width, 7), (0, 8, 1, 9)):
+        assert_same_as_crop(path, crop_box)
+
+@pytest.mark.parametrize('mode', ['L', 'LA', 'I;16', 'RGB', 'RGBA', 'CMYK', 'P'])
+@pytest.mark.parametrize('crop_box', CROP_BOXES)
+def test_tiff_strips(tmp_path, mode, crop_box):
+    # Strips of 7 rows, so crops start and end inside strips
+    path = tmp_path / 'in.tif'
+    noisy(mode, SIZE).save(path, tiffinfo={278: 7})
+    with Image.open(path) as img:
+        assert len(img.tile) == 7
+    assert_same_as_crop(path, crop_box)
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+@pytest.mark.parametrize('crop_box', CROP_BOXES)
+def test_tiff_tiles(tmp_path, mode, crop_box):
+    # 16x16 tiles; the right and bottom ones stick out of the image
+    path = tmp_path / 'in.tif'
+    img = noisy(mode, SIZE)
+    path.write_bytes(tiled_tiff(img, 16))
+    with Image.open(path) as opened:
+        assert len(opened.tile) == 12
+    assert_same_as_crop(path, crop_box)
+    with Image.open(path) as opened:
+        assert mapped_crop(opened, crop_box).tobytes() == img.crop(crop_box).tobytes()
+
+def test_unmappable(tmp_path):
+    noisy('RGB', SIZE).save(tmp_path / 'lzw.tif', compression='tiff_lzw')
+    noisy('1', SIZE).save(tmp_path / 'bits.bmp')
+    noisy('RGB', SIZE).save(tmp_path / 'in.bmp')
+    with Image.open(tmp_path / 'lzw.tif') as img:
+        assert mapped_crop(img, (0, 0, 10, 10)) is None
+    with Image.open(tmp_path / 'bits.bmp') as img:
+        assert mapped_crop(img, (0, 0, 10, 10)) is None
+    with Image.open(tmp_path / 'in.bmp') as img:
+        assert mapped_crop(img, (-5, 0, 10, 10)) is None
+        assert mapped_crop(img, (0, 0, 62, 10)) is None
+    with Image.open(io.BytesIO((tmp_path / 'in.bmp').read_bytes())) as img:
+        assert mapped_crop(img, (0, 0, 10, 10)) is None
+
+def test_truncated_bmp(tmp_path):
+    path = tmp_path / 'in.bmp'
+    noisy('RGB', SIZE).save(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    with Image.open(path) as img:
+        # Bottom-up, so the bottom rows are still in the file and the top ones are not
+        assert mapped_crop(img, (0, 40, 61, 47)) is not None
+        with pytest.raises(ValueError):
+            mapped_crop(img, (0, 0, 61, 7))
+
+@pytest.mark.parametrize('output_size', [None, (17, 6)])
+def test_crop_one(tmp_path, output_size):
+    path = tmp_path / 'in.bmp'
+    img = noisy('RGB', SIZE)
+    img.save(path)
+    _, data = crop_one(path, (5, 13, 56, 30), output_format='BMP', output_size=output_size)
+    expected = img.crop((5, 13, 56, 30))
+    if output_size is not None:
+        expected = expected.resize(output_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.tobytes() == expected.tobytes()
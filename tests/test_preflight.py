@@ -0,0 +1,46 @@
+"""Tests for the header-only truncation checks."""
+from PIL import Image
+from piccropper.preflight import check_truncated, preflight_scan
+import io
+import pytest
+
+def encoded(image_format, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 40).convert('RGB').save(buffer, format=image_format)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize('image_format', ['PNG', 'JPEG', 'GIF', 'BMP'])
+def test_complete_files_pass(tmp_path, image_format):
+    path = tmp_path / f"a.{image_format.lower()}"
+    path.write_bytes(encoded(image_format))
+    assert check_truncated(str(path), image_format) is None
+
+@pytest.mark.parametrize('image_format, suffix', [
+    ('PNG', b'\n'),
+    ('PNG', b'x' * 300),
+    ('JPEG', b'\x00' * 16),
+    ('JPEG', b'VENDOR-TRAILER' + bytes(range(190))),  # e.g. a camera's metadata trailer
+], ids=['png-newline', 'png-300-bytes', 'jpeg-padding', 'jpeg-vendor-trailer'])
+def test_data_after_end_marker_passes(tmp_path, image_format, suffix):
+    path = tmp_path / f"a.{image_format.lower()}"
+    path.write_bytes(encoded(image_format) + suffix)
+    with Image.open(path) as img:
+        img.load()  # Pillow decodes it, so the pre-flight check must not reject it
+    assert check_truncated(str(path), image_format) is None
+
+@pytest.mark.parametrize('image_format', ['PNG', 'JPEG', 'GIF', 'BMP'])
+def test_truncated_files_fail(tmp_path, image_format):
+    data = encoded(image_format, (256, 256))
+    path = tmp_path / f"a.{image_format.lower()}"
+    path.write_bytes(data[:len(data) * 2 // 3])
+    assert check_truncated(str(path), image_format).startswith('truncated')
+
+def test_preflight_scan(tmp_path):
+    Image.new('RGB', (100, 80)).save(tmp_path / 'big.png')
+    Image.new('RGB', (40, 30)).save(tmp_path / 'small.png')
+    data = encoded('PNG', (100, 80))
+    (tmp_path / 'cut.png').write_bytes(data[:len(data) // 2])
+    report = preflight_scan(str(tmp_path), ['big.png', 'cut.png', 'small.png'], (10, 10, 60, 60))
+    assert report['out_of_bounds'] == ['small.png']
+    assert [fname for fname, _ in report['unreadable']] == ['cut.png']
+    assert report['groups'][(100, 80, 'RGB', 'PNG')] == ['big.png']
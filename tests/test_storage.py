@@ -0,0 +1,168 @@
+"""Tests for the S3 backend, crop_between() and merging remote manifests,
+against a local moto S3 server.
+
+Run from the repository root with: python -m pytest tests
+"""
+from PIL import Image
+import io
+import json
+import os
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+from piccropper.sharding import build_manifest, merge_manifests
+from piccropper.storage import LocalStorage, S3Storage, crop_between, open_storage
+
+MULTIPART_SIZE = 5 * 1024 * 1024  # Smallest part S3 accepts for all but the last part
+
+@pytest.fixture(scope='module')
+def endpoint_url():
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+@pytest.fixture
+def client(endpoint_url):
+    return boto3.client('s3', endpoint_url=endpoint_url)
+
+@pytest.fixture
+def bucket(client, request):
+    name = request.node.name.replace('_', '-').lower()[:63]
+    client.create_bucket(Bucket=name)
+    return name
+
+def png_bytes(size, color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def test_open_storage(endpoint_url):
+    storage = open_storage('s3://scans/2024/batch', endpoint_url=endpoint_url)
+    assert isinstance(storage, S3Storage)
+    assert (storage.bucket, storage.prefix) == ('scans', '2024/batch/')
+    assert storage.url('a.png') == 's3://scans/2024/batch/a.png'
+    assert isinstance(open_storage('pic-input'), LocalStorage)
+    with pytest.raises(ValueError):
+        open_storage('ftp://host/folder')
+
+def test_list_images(client, bucket, endpoint_url):
+    for key, body in (('in/b.png', b'12'), ('in/a.JPG', b'1'), ('in/notes.txt', b'x'),
+                      ('in/sub/c.png', b'x'), ('other/d.png', b'x'), ('in/scan.tif', b'x')):
+        client.put_object(Bucket=bucket, Key=key, Body=body)
+    storage = S3Storage(bucket, 'in', endpoint_url=endpoint_url)
+    # Only images directly under the prefix
+    assert storage.list_images() == ['a.JPG', 'b.png', 'scan.tif']
+    assert storage.size('b.png') == 2
+    assert storage.exists('a.JPG')
+    assert not storage.exists('missing.png')
+    storage.close()
+
+def test_ranged_read(client, bucket, endpoint_url):
+    data = os.urandom(10_000)
+    client.put_object(Bucket=bucket, Key='obj.png', Body=data)
+    storage = S3Storage(bucket, endpoint_url=endpoint_url, part_size=1024)
+    assert storage.read_range('obj.png', 100, 164) == data[100:164]
+    assert storage.read_range('obj.png', 9_990, 10_000) == data[-10:]
+    assert storage.read_range('obj.png', 5, 5) == b''
+    # Larger than part_size, so fetched as concurrent ranged GETs
+    assert storage.read('obj.png') == data
+    storage.close()
+
+def test_multipart_write(client, bucket, endpoint_url):
+    data = os.urandom(2 * MULTIPART_SIZE + 12_345)
+    storage = S3Storage(bucket, 'out', endpoint_url=endpoint_url, part_size=MULTIPART_SIZE)
+    storage.write('big.png', data)
+    storage.write('small.png', b'tiny')
+    assert client.get_object(Bucket=bucket, Key='out/big.png')['Body'].read() == data
+    assert client.get_object(Bucket=bucket, Key='out/small.png')['Body'].read() == b'tiny'
+    assert 'Uploads' not in client.list_multipart_uploads(Bucket=bucket)
+    storage.close()
+
+def test_multipart_write_aborts_on_failure(client, bucket, endpoint_url):
+    storage = S3Storage(bucket, endpoint_url=endpoint_url, part_size=MULTIPART_SIZE)
+
+    def fail_second_part(params, **kwargs):
+        if params.get('PartNumber') == 2:
+            raise ConnectionError("connection dropped")
+    storage.client.meta.events.register('before-parameter-build.s3.UploadPart', fail_second_part)
+
+    with pytest.raises(ConnectionError):
+        storage.write('big.png', os.urandom(2 * MULTIPART_SIZE + 1))
+    assert not storage.exists('big.png')
+    assert 'Uploads' not in client.list_multipart_uploads(Bucket=bucket)
+    storage.close()
+
+def test_crop_between_buckets(client, bucket, endpoint_url):
+    for name, color in (('a.png', 'red'), ('b.png', 'blue'), ('c.png', 'green')):
+        client.put_object(Bucket=bucket, Key=f"in/{name}", Body=png_bytes((64, 48), color))
+    client.put_object(Bucket=bucket, Key='in/broken.png', Body=b'not an image')
+    source = S3Storage(bucket, 'in', endpoint_url=endpoint_url)
+    target = S3Storage(bucket, 'out', endpoint_url=endpoint_url)
+    names = source.list_images()
+
+    results = {r['source']: r for r in crop_between(source, target, names, (8, 4, 40, 36),
+                                                    transfer_workers=2, prefetch=2)}
+    assert sorted(results) == ['a.png', 'b.png', 'broken.png', 'c.png']
+    assert results['broken.png']['status'] == 'error'
+    for name, color in (('a.png', 'red'), ('b.png', 'blue'), ('c.png', 'green')):
+        result = results[name]
+        assert result['status'] == 'ok'
+        assert result['output'] == name.replace('.png', '-cropped.png')
+        data = target.read(result['output'])
+        assert result['bytes'] == len(data)
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.size == (32, 32)
+            assert img.getpixel((0, 0)) == Image.new('RGB', (1, 1), color).getpixel((0, 0))
+    source.close()
+    target.close()
+
+def test_crop_between_local_and_s3(client, bucket, endpoint_url, tmp_path):
+    (tmp_path / 'in').mkdir()
+    (tmp_path / 'in' / 'a.png').write_bytes(png_bytes((20, 20)))
+    target = S3Storage(bucket, 'crops', endpoint_url=endpoint_url)
+
+    results = list(crop_between(LocalStorage(tmp_path / 'in'), target, ['a.png'], (0, 0, 10, 10),
+                                output_format='JPEG'))
+    assert [(r['source'], r['status'], r['output']) for r in results] == \
+        [('a.png', 'ok', 'a-cropped.jpg')]
+    assert target.exists('a-cropped.jpg')
+
+    # And back from the bucket into a local folder
+    output = LocalStorage(tmp_path / 'out')
+    results = list(crop_between(target, output, ['a-cropped.jpg'], (0, 0, 5, 5)))
+    assert results[0]['status'] == 'ok'
+    with Image.open(output.local_path(results[0]['output'])) as img:
+        assert (img.format, img.size) == ('JPEG', (5, 5))
+    target.close()
+
+def test_merge_remote_manifests(client, bucket, endpoint_url):
+    for name in ('a.png', 'b.png', 'c.png'):
+        client.put_object(Bucket=bucket, Key=f"in/{name}", Body=png_bytes((8, 8)))
+    input_folder = f"s3://{bucket}/in"
+    shards = [(0, 2, ['a.png']), (1, 2, ['b.png'])]
+    for index, count, names in shards:
+        results = [{'file': name, 'status': 'ok', 'seconds': 0.1} for name in names]
+        manifest = build_manifest(input_folder, (0, 0, 4, 4), (index, count), results)
+        client.put_object(Bucket=bucket, Key=f"out/manifest-shard-{index}-of-{count}.json",
+                          Body=json.dumps(manifest).encode('utf-8'))
+
+    paths = [f"s3://{bucket}/out/manifest-shard-{index}-of-2.json" for index in range(2)]
+    summary = merge_manifests(paths, endpoint_url=endpoint_url)
+    assert summary['processed_count'] == 2
+    assert summary['missing_shards'] == []
+    assert summary['missing_files'] == [f"{input_folder}/c.png"]
+    assert summary['problems'] == ["1 input files are not in any manifest"]
+
+    # A folder that cannot be listed is reported, not silently passed
+    manifest = build_manifest(f"s3://{bucket}-missing/in", (0, 0, 4, 4), None, [])
+    client.put_object(Bucket=bucket, Key='out/other.json',
+                      Body=json.dumps(manifest).encode('utf-8'))
+    summary = merge_manifests([f"s3://{bucket}/out/other.json"], endpoint_url=endpoint_url)
+    assert len(summary['problems']) == 1 and 'coverage was not checked' in summary['problems'][0]
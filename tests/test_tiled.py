@@ -0,0 +1,185 @@
+"""Band-by-band cropping must give exactly the pixels Image.crop gives. The
+band path only runs for very large inputs, so these tests lower
+TILED_PIXEL_THRESHOLD and BAND_BYTES to push small images through it."""
+from PIL import Image
+import io
+import pytest
+import struct
+import zlib
+
+numpy = pytest.importorskip('numpy')
+
+from piccropper import encoders, engine, tiled
+from piccropper.encoders import save_parallel_png
+from piccropper.engine import crop_one
+from piccropper.tiled import PNG_SIGNATURE, PNG_STREAM_LAYOUTS, PNGStreamWriter, tiled_crop
+
+SIZE = (61, 47)
+# Boxes touching each edge, a single pixel, one full row and the whole image
+CROP_BOXES = [(0, 0, 61, 47), (0, 0, 20, 9), (5, 13, 56, 30), (40, 38, 61, 47),
+              (30, 23, 31, 24), (0, 46, 61, 47)]
+
+def noisy(mode, size, seed=0):
+    """An image of the mode with gradients and noise, so the PNG encoder uses every filter type"""
+    rng = numpy.random.default_rng(seed)
+    width, height = size
+    bands = len(Image.new(mode, (1, 1)).getbands())
+    y, x = numpy.mgrid[0:height, 0:width]
+    values = (x * 3 + y * 5)[..., None] + rng.integers(0, 40, (height, width, bands))
+    values[: height // 3] = rng.integers(0, 256, (height // 3, width, bands))
+    if mode == 'I;16':
+        return Image.frombytes('I;16', size, (values[..., 0] * 251).astype('<u2').tobytes())
+    values = (values % 256).astype(numpy.uint8)
+    if mode == 'P':
+        img = Image.fromarray(values[..., 0], 'L').convert('P')
+        img.putpalette(rng.integers(0, 256, 768, numpy.uint8).tobytes())
+        return img
+    return Image.fromarray(values.squeeze(-1) if bands == 1 else values, mode)
+
+@pytest.fixture
+def banded(monkeypatch):
+    """Route every crop_one call through tiled_crop, with bands of a few rows"""
+    monkeypatch.setattr(engine, 'TILED_PIXEL_THRESHOLD', 0)
+    monkeypatch.setattr(tiled, 'BAND_BYTES', 500)
+    calls = []
+    iter_png_bands = tiled.iter_png_bands
+
+    def counting(*args):
+        calls.append(args[2])
+        return iter_png_bands(*args)
+    monkeypatch.setattr(tiled, 'iter_png_bands', counting)
+    return calls
+
+def interlaced_png(img):
+    """An Adam7 interlaced PNG of an L image (Pillow only writes non-interlaced ones)"""
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data
+                + struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    pixels = numpy.asarray(img)
+    raw = b''
+    for x0, y0, dx, dy in ((0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4),
+                           (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2)):
+        for row in pixels[y0::dy, x0::dx]:
+            if row.size:
+                raw += b'\x00' + row.tobytes()
+    return (PNG_SIGNATURE + chunk(b'IHDR', struct.pack('>IIBBBBB', *img.size, 8, 0, 0, 0, 1))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def decode(data):
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+def assert_same_pixels(decoded, expected):
+    assert decoded.mode == expected.mode
+    assert decoded.size == expected.size
+    assert decoded.tobytes() == expected.tobytes()
+    if expected.mode == 'P':
+        assert decoded.getpalette() == expected.getpalette()
+
+@pytest.mark.parametrize('mode', ['L', 'LA', 'RGB', 'RGBA', 'P'])
+@pytest.mark.parametrize('crop_box', CROP_BOXES)
+def test_png_bands(tmp_path, banded, mode, crop_box):
+    path = tmp_path / 'in.png'
+    img = noisy(mode, SIZE)
+    img.save(path)
+
+    _, data = crop_one(path, crop_box, output_format='PNG')
+    assert banded == [crop_box]
+    assert_same_pixels(decode(data), img.crop(crop_box))
+
+@pytest.mark.parametrize('band_bytes', [1, 62, 500, 10 ** 9])
+def test_band_sizes(tmp_path, banded, monkeypatch, band_bytes):
+    # One row per band, exactly one full row plus filter byte, and the whole image in one band
+    monkeypatch.setattr(tiled, 'BAND_BYTES', band_bytes)
+    path = tmp_path / 'in.png'
+    img = noisy('L', SIZE, seed=band_bytes)
+    img.save(path)
+    for crop_box in CROP_BOXES:
+        _, data = crop_one(path, crop_box, output_format='PNG')
+        assert_same_pixels(decode(data), img.crop(crop_box))
+
+def test_many_idat_chunks(tmp_path, banded, monkeypatch):
+    # Bands that start and end inside IDAT chunks, and chunks smaller than a row
+    monkeypatch.setattr(encoders, 'CHUNK_BYTES', 100)
+    path = tmp_path / 'in.png'
+    img = noisy('RGB', SIZE)
+    with open(path, 'wb') as f:
+        save_parallel_png(img, f, threads=2)
+    for crop_box in CROP_BOXES:
+        _, data = crop_one(path, crop_box, output_format='PNG')
+        assert_same_pixels(decode(data), img.crop(crop_box))
+
+def test_palette_transparency_and_dpi(tmp_path, banded):
+    path = tmp_path / 'in.png'
+    img = noisy('P', SIZE)
+    img.save(path, transparency=bytes(range(0, 256, 3)), dpi=(300, 300))
+
+    output_path = tmp_path / 'out.png'
+    crop_one(path, (5, 13, 56, 30), output_path=str(output_path))
+    with Image.open(path) as source, Image.open(output_path) as cropped:
+        assert_same_pixels(cropped, source.crop((5, 13, 56, 30)))
+        assert cropped.info['transparency'] == source.info['transparency']
+        assert cropped.info['dpi'] == pytest.approx(source.info['dpi'], abs=0.01)
+
+@pytest.mark.parametrize('output_format', ['BMP', 'TIFF'])
+def test_assembled_outputs(tmp_path, banded, output_format):
+    # Non-PNG outputs are pasted together at crop size before saving
+    path = tmp_path / 'in.png'
+    img = noisy('RGB', SIZE)
+    img.save(path)
+    _, data = crop_one(path, (5, 13, 56, 30), output_format=output_format)
+    decoded = decode(data)
+    assert decoded.format == output_format
+    assert_same_pixels(decoded, img.crop((5, 13, 56, 30)))
+
+def test_resized_output(tmp_path, banded):
+    path = tmp_path / 'in.png'
+    img = noisy('RGBA', SIZE)
+    img.save(path)
+    _, data = crop_one(path, (5, 13, 56, 30), output_format='PNG', output_size=(17, 6))
+    expected = img.crop((5, 13, 56, 30)).resize((17, 6), Image.Resampling.LANCZOS,
+                                                 reducing_gap=3.0)
+    assert_same_pixels(decode(data), expected)
+
+@pytest.mark.parametrize('kind', ['interlaced', '16-bit'])
+def test_unbanded_png_falls_back(tmp_path, banded, kind):
+    path = tmp_path / 'in.png'
+    if kind == 'interlaced':
+        img = noisy('L', SIZE)
+        path.write_bytes(interlaced_png(img))
+    else:
+        img = noisy('I;16', SIZE)
+        img.save(path)
+    with Image.open(path) as source:
+        assert tiled_crop(str(path), source, (5, 13, 56, 30)) is NotImplemented
+    # crop_one then decodes the whole image, with the same result
+    _, data = crop_one(path, (5, 13, 56, 30), output_format='PNG')
+    assert banded == []
+    assert_same_pixels(decode(data), img.crop((5, 13, 56, 30)))
+
+def test_truncated_png(tmp_path, banded):
+    path = tmp_path / 'in.png'
+    noisy('RGB', SIZE).save(path)
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        crop_one(path, (0, 40, 61, 47), output_format='PNG')
+
+@pytest.mark.parametrize('mode', sorted(PNG_STREAM_LAYOUTS))
+@pytest.mark.parametrize('compress_level', [0, 6, 9])
+def test_stream_writer(mode, compress_level):
+    img = noisy(mode, SIZE)
+    buffer = io.BytesIO()
+    writer = PNGStreamWriter(buffer, img.width, img.height, mode, compress_level,
+                             tiled._stream_chunks(img))
+    # Bands of uneven height, down to a single row
+    for top, bottom in ((0, 1), (1, 8), (8, 30), (30, 47)):
+        writer.write_band(img.crop((0, top, img.width, bottom)))
+    writer.close()
+    assert_same_pixels(decode(buffer.getvalue()), img)
+
+def test_stream_writer_rejects_other_modes():
+    with pytest.raises(ValueError):
+        PNGStreamWriter(io.BytesIO(), 4, 4, 'CMYK')